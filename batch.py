@@ -0,0 +1,179 @@
+# Headless measurements of screenshot files, no display or PyQt needed
+# python batch.py screenshots/ --pair 10 20 110 20 --pair 0 0 50 50 > results.jsonl
+# python batch.py screenshots/ shot.png --detect --ppi 96 --workers 8 --output results.jsonl
+#
+# Every measurement is written as soon as its file is done, one JSON object
+# per line, with the same px/cm/inch values the ruler shows. Files are spread
+# over a pool of processes, the results keep the order of the files.
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from capture import np
+from dimensions import measure
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff", ".webp")
+
+def find_images(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+def record(path, kind, x0, y0, x1, y1, ppix, ppiy, **extra):
+    result = {"file": path, "kind": kind, "start": [x0, y0], "end": [x1, y1]}
+    result.update(extra)
+    result.update(measure(x0, y0, x1, y1, ppix, ppiy))
+    return result
+
+def foreground_mask(pixels, threshold):
+    # Everything that differs from the background, which is the most common color of the image's border
+    border = np.concatenate((pixels[0], pixels[-1], pixels[:, 0], pixels[:, -1]))
+    colors, counts = np.unique(border, axis=0, return_counts=True)
+    background = colors[counts.argmax()].astype(np.int16)
+    return (np.abs(pixels.astype(np.int16) - background).max(axis=2) > threshold)
+
+def runs(filled):
+    # (start, end) of each run of True values, end exclusive
+    padded = np.concatenate(([False], filled, [False])).astype(np.int8)
+    changes = np.flatnonzero(np.diff(padded))
+    return list(zip(changes[::2].tolist(), changes[1::2].tolist()))
+
+def detect_elements(mask, min_gap=1, depth=0):
+    # Bounding boxes (left, top, right, bottom) of the elements, right and bottom exclusive.
+    # Recursive XY cut: the mask is split at rows with nothing on them (gaps), then each
+    # band at empty columns, and so on until a box can't be split anymore
+    rows = runs(mask.any(axis=1))
+    if not rows:
+        return []
+    top, bottom = rows[0][0], rows[-1][1]
+    cols = runs(mask[top:bottom].any(axis=0))
+    left, right = cols[0][0], cols[-1][1]
+    rows = merge_runs(rows, min_gap)
+    cols = merge_runs(cols, min_gap)
+    if len(rows) == 1 and len(cols) == 1 or depth > 32:
+        return [(left, top, right, bottom)]
+
+    boxes = []
+    if len(rows) > 1:
+        for start, end in rows:
+            for box in detect_elements(mask[start:end], min_gap, depth + 1):
+                boxes.append((box[0], box[1] + start, box[2], box[3] + start))
+    else:
+        for start, end in cols:
+            for box in detect_elements(mask[:, start:end], min_gap, depth + 1):
+                boxes.append((box[0] + start, box[1], box[2] + start, box[3]))
+    return boxes
+
+def merge_runs(spans, min_gap):
+    # Gaps smaller than min_gap don't separate elements
+    merged = [list(spans[0])]
+    for start, end in spans[1:]:
+        if start - merged[-1][1] < min_gap:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+def gaps(boxes):
+    # Space between each element and the closest one to its right and below it, when they overlap in the other axis
+    result = []
+    for index, a in enumerate(boxes):
+        right = None
+        below = None
+        for b in boxes:
+            if b is a:
+                continue
+            if b[0] >= a[2] and b[1] < a[3] and a[1] < b[3] and (right is None or b[0] < right[0]):
+                right = b
+            if b[1] >= a[3] and b[0] < a[2] and a[0] < b[2] and (below is None or b[1] < below[1]):
+                below = b
+        if right is not None and right[0] > a[2]:
+            y = (max(a[1], right[1]) + min(a[3], right[3]) - 1)//2
+            result.append(("horizontal", index, boxes.index(right), a[2], y, right[0] - 1, y))
+        if below is not None and below[1] > a[3]:
+            x = (max(a[0], below[0]) + min(a[2], below[2]) - 1)//2
+            result.append(("vertical", index, boxes.index(below), x, a[3], x, below[1] - 1))
+    return result
+
+def process_file(path, pairs, detect, ppix, ppiy, threshold, min_gap):
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+            pixels = np.asarray(img.convert("RGB")) if detect else None
+    except OSError as e:
+        return [{"file": path, "error": str(e)}]
+
+    results = []
+    for x0, y0, x1, y1 in pairs:
+        if not (0 <= min(x0, x1) and max(x0, x1) < width and 0 <= min(y0, y1) and max(y0, y1) < height):
+            results.append({"file": path, "kind": "pair", "start": [x0, y0], "end": [x1, y1],
+                            "error": "outside the image"})
+            continue
+        results.append(record(path, "pair", x0, y0, x1, y1, ppix, ppiy))
+
+    if detect:
+        boxes = detect_elements(foreground_mask(pixels, threshold), min_gap)
+        for index, (left, top, right, bottom) in enumerate(boxes):
+            results.append(record(path, "element", left, top, right - 1, bottom - 1, ppix, ppiy, element=index))
+        for direction, a, b, x0, y0, x1, y1 in gaps(boxes):
+            results.append(record(path, "gap", x0, y0, x1, y1, ppix, ppiy, direction=direction, between=[a, b]))
+    return results
+
+def run(paths, pairs, detect, ppix, ppiy, workers=None, threshold=24, min_gap=1, out=sys.stdout):
+    files = list(find_images(paths))
+    args = (pairs, detect, ppix, ppiy, threshold, min_gap)
+    if workers == 1 or len(files) <= 1:
+        results = (process_file(path, *args) for path in files)
+        write_results(results, out)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Bigger chunks mean less inter-process traffic, small enough to keep every worker busy
+            workers = workers or os.cpu_count() or 1
+            chunksize = max(1, min(32, len(files) // (workers * 4)))
+            results = executor.map(process_file, files, *[[arg] * len(files) for arg in args], chunksize=chunksize)
+            write_results(results, out)
+
+def write_results(results, out):
+    for file_results in results:
+        for result in file_results:
+            out.write(json.dumps(result) + "\n")
+        out.flush()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure screenshot files without the ruler's window")
+    parser.add_argument("paths", nargs="+", help="image files or directories with images")
+    parser.add_argument("--pair", nargs=4, type=int, action="append", default=[], metavar=("X0", "Y0", "X1", "Y1"),
+                        help="measure from (X0, Y0) to (X1, Y1), can be repeated")
+    parser.add_argument("--detect", action="store_true", help="measure the elements found in the images and the gaps between them")
+    parser.add_argument("--ppi", type=float, default=96, help="pixels per inch of the screenshots")
+    parser.add_argument("--ppix", type=float, help="horizontal pixels per inch, overrides --ppi")
+    parser.add_argument("--ppiy", type=float, help="vertical pixels per inch, overrides --ppi")
+    parser.add_argument("--threshold", type=int, default=24, help="minimum color difference with the background to be part of an element")
+    parser.add_argument("--min-gap", type=int, default=1, help="smaller gaps don't separate elements")
+    parser.add_argument("--workers", type=int, help="number of processes, by default one per CPU")
+    parser.add_argument("--output", help="write the JSONL results to this file instead of stdout")
+    args = parser.parse_args()
+
+    if not args.pair and not args.detect:
+        parser.error("nothing to measure, use --pair and/or --detect")
+    if args.detect and np is None:
+        parser.error("--detect needs numpy")
+    ppix = args.ppix or args.ppi
+    ppiy = args.ppiy or args.ppi
+    pairs = [tuple(pair) for pair in args.pair]
+
+    if args.output:
+        with open(args.output, "w") as f:
+            run(args.paths, pairs, args.detect, ppix, ppiy, args.workers, args.threshold, args.min_gap, f)
+    else:
+        run(args.paths, pairs, args.detect, ppix, ppiy, args.workers, args.threshold, args.min_gap)
@@ -0,0 +1,278 @@
+# Headless benchmarks for the paint and capture hot paths
+# python benchmark.py > results.json
+# python benchmark.py --resolutions 4k --measurements 100 --frames 200 --output results.json
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import QPoint
+from PyQt5.QtGui import QCursor, QImage, QPainter, QRegion
+
+from capture import FakeCapture
+from dimensions import labels_many, measure_many
+from monitors import Monitor, MonitorIndex
+from screenruler import RulerWindow
+
+# name -> monitors as (left, top, width, height)
+RESOLUTIONS = {
+    "1080p": [(0, 0, 1920, 1080)],
+    "4k": [(0, 0, 3840, 2160)],
+    "triple": [(0, 0, 1920, 1080), (1920, 0, 1920, 1080), (3840, 0, 1920, 1080)]
+}
+MEASUREMENTS = [1, 100, 10000]
+PAIRS = 1000000
+
+def percentiles(samples, scale=1000):
+    # Summary in ms of samples in seconds (scale=1 for samples that already are ms),
+    # shared by replay.py and startup.py
+    samples = sorted(samples)
+    def percentile(p):
+        return samples[min(len(samples)-1, int(p/100 * len(samples)))] * scale
+    total = sum(samples) * scale
+    return {
+        "count": len(samples),
+        "p50_ms": percentile(50),
+        "p90_ms": percentile(90),
+        "p99_ms": percentile(99),
+        "min_ms": samples[0] * scale,
+        "max_ms": samples[-1] * scale,
+        "mean_ms": total/len(samples),
+        "total_ms": total
+    }
+
+def write_results(result, path=None):
+    # As JSON, to path or to stdout without one
+    text = json.dumps(result, indent=2)
+    if path:
+        with open(path, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+def measure(step, frames):
+    # Time every call of step(frame), then run it again under tracemalloc to count allocations
+    # (timing and allocation tracking are kept apart since tracemalloc slows everything down)
+    samples = []
+    for frame in range(frames):
+        start = time.perf_counter()
+        step(frame)
+        samples.append(time.perf_counter() - start)
+    result = percentiles(samples)
+    result["fps"] = 1000/result["mean_ms"] if result["mean_ms"] > 0 else None
+
+    alloc_frames = min(frames, 50)
+    tracemalloc.start()
+    peak = 0
+    blocks = 0
+    for frame in range(alloc_frames):
+        before_blocks = sys.getallocatedblocks()
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        step(frame)
+        peak += tracemalloc.get_traced_memory()[1] - current
+        blocks += sys.getallocatedblocks() - before_blocks
+    tracemalloc.stop()
+    result["alloc_peak_bytes_per_frame"] = peak / alloc_frames
+    result["alloc_net_blocks_per_frame"] = blocks / alloc_frames
+    result["frames"] = frames
+    return result
+
+def cursor_path(monitors, frames):
+    # Deterministic cursor stream that sweeps every monitor
+    left = min(m[0] for m in monitors)
+    top = min(m[1] for m in monitors)
+    right = max(m[0] + m[2] for m in monitors)
+    bottom = max(m[1] + m[3] for m in monitors)
+    points = []
+    for frame in range(frames):
+        t = frame / max(frames - 1, 1)
+        x = left + (right - left - 1) * (0.5 + 0.5 * math.sin(2 * math.pi * 3 * t))
+        y = top + (bottom - top - 1) * (0.5 + 0.5 * math.sin(2 * math.pi * 2 * t + 0.5))
+        points.append((int(x), int(y)))
+    return points
+
+def create_ruler(monitors, seed=0, desktop=None):
+    # desktop: image of the whole virtual desktop shown by the fake capture, random noise by default
+    left = min(m[0] for m in monitors)
+    top = min(m[1] for m in monitors)
+    right = max(m[0] + m[2] for m in monitors)
+    bottom = max(m[1] + m[3] for m in monitors)
+    if desktop is None:
+        rng = np.random.default_rng(seed)
+        desktop = rng.integers(0, 256, size=(bottom - top, right - left, 3), dtype=np.uint8)
+
+    monitor_index = MonitorIndex([Monitor(*m, 96, 96, "bench" + str(index)) for index, m in enumerate(monitors)])
+    ruler = RulerWindow(capture=FakeCapture(desktop), fps=1000, monitors=monitor_index)
+    width, height = monitors[0][2], monitors[0][3]
+    ruler.set_sizes(str(width), str(height), "24")
+    ruler.resize(width, height)
+    ruler.show()
+    # Let the window be exposed, otherwise repaint() does nothing
+    QApplication.processEvents()
+    return ruler
+
+def add_measurements(ruler, count, seed=0):
+    # Like annotations of a mockup: anywhere on the screen, up to 200px long in each axis
+    rng = random.Random(seed)
+    for _ in range(count):
+        start = QPoint(rng.randrange(ruler.h_res), rng.randrange(ruler.v_res))
+        end = QPoint(min(max(start.x() + rng.randint(-200, 200), 0), ruler.h_res - 1),
+                     min(max(start.y() + rng.randint(-200, 200), 0), ruler.v_res - 1))
+        ruler.add_measurement(start, end)
+    ruler.invalidate_measurement_layer()
+
+def bench_overlay(app, name, monitors, count, frames):
+    # Full frame: mouse move -> scheduler -> dirty region paint of the ruler and the preview
+    ruler = create_ruler(monitors)
+    add_measurements(ruler, count)
+    start = time.perf_counter()
+    ruler.render_measurement_layer()
+    layer_build = time.perf_counter() - start
+    path = cursor_path(monitors, frames)
+
+    def step(frame):
+        QCursor.setPos(*path[frame])
+        ruler.mouseMoveEvent(None)
+        ruler.scheduler.flush()
+        app.processEvents()
+
+    result = measure(step, frames)
+    result.update({"benchmark": "overlay_frame", "resolution": name, "measurements": count,
+                   "layer_build_ms": layer_build * 1000, "label_cache": ruler.label_cache.stats()})
+    ruler.close()
+    return result
+
+def bench_measurement_queries(app, name, monitors, count, frames):
+    # Hit test, nearest measurement and viewport query around the cursor
+    ruler = create_ruler(monitors)
+    add_measurements(ruler, count)
+    path = cursor_path(monitors[:1], frames)
+    store = ruler.measurements
+
+    def step(frame):
+        x, y = path[frame]
+        store.hit_test(x, y)
+        store.nearest(x, y)
+        store.query_rect(x - 100, y - 100, x + 100, y + 100)
+
+    result = measure(step, frames)
+    result.update({"benchmark": "measurement_queries", "resolution": name, "measurements": count})
+    ruler.close()
+    return result
+
+def bench_background(app, name, monitors, frames):
+    ruler = create_ruler(monitors)
+    image = QImage(ruler.h_res, ruler.v_res, QImage.Format_ARGB32_Premultiplied)
+    path = cursor_path(monitors, frames)
+
+    def step(frame):
+        QCursor.setPos(*path[frame])
+        ruler.preview.update_pos()
+        painter = QPainter(image)
+        ruler.paint_background(painter, image.rect())
+        painter.end()
+
+    result = measure(step, frames)
+    result.update({"benchmark": "paint_background", "resolution": name})
+    ruler.close()
+    return result
+
+def bench_grid(app, name, monitors, frames):
+    # Whole screen pixel grid and a few guides, the tile is only drawn in the first frame
+    ruler = create_ruler(monitors)
+    ruler.grid.mode = ruler.grid.PIXEL
+    for position in range(0, ruler.v_res, ruler.v_res // 10):
+        ruler.grid.toggle_guide(False, position, ruler.h_res, ruler.v_res)
+        ruler.grid.toggle_guide(True, position, ruler.h_res, ruler.v_res)
+    image = QImage(ruler.h_res, ruler.v_res, QImage.Format_ARGB32_Premultiplied)
+    region = QRegion(image.rect())
+
+    def step(frame):
+        painter = QPainter(image)
+        ruler.grid.paint(painter, region, ruler.h_res, ruler.v_res)
+        painter.end()
+
+    result = measure(step, frames)
+    result.update({"benchmark": "paint_grid", "resolution": name, "spacing": ruler.grid.spacing})
+    ruler.close()
+    return result
+
+def bench_preview(app, name, monitors, frames):
+    # Magnifier paint, the capture is invalidated every frame like when the cursor moves
+    ruler = create_ruler(monitors)
+    path = cursor_path(monitors, frames)
+
+    def step(frame):
+        QCursor.setPos(*path[frame])
+        ruler.preview.update_pos()
+        ruler.preview.capture.invalidate()
+        ruler.preview.repaint()
+
+    result = measure(step, frames)
+    result.update({"benchmark": "preview_paint", "resolution": name})
+    ruler.close()
+    return result
+
+def bench_monitors(app, name, monitors, frames):
+    # Replacement of get_corners_coords: resolving the monitor and the magnifier's bounds
+    monitor_index = MonitorIndex([Monitor(*m, 96, 96) for m in monitors])
+    path = cursor_path(monitors, frames)
+
+    def step(frame):
+        x, y = path[frame]
+        monitor_index.screen_at(x, y).loupe_bounds(x, y, (21, 21))
+
+    result = measure(step, frames)
+    result.update({"benchmark": "monitor_resolve", "resolution": name})
+    return result
+
+def bench_dimensions(count, frames, seed=0):
+    # The measurement math alone, over count random pairs at once
+    rng = np.random.default_rng(seed)
+    x0, y0, x1, y1 = rng.integers(0, 3840, size=(4, count))
+    ppix = rng.uniform(90, 200, size=count)
+
+    result = measure(lambda frame: measure_many(x0, y0, x1, y1, ppix, ppix), frames)
+    result.update({"benchmark": "dimensions", "pairs": count})
+    # Formatting the texts is python code per pair, measured on fewer of them
+    label_count = min(count, 10000)
+    dimensions = measure_many(x0[:label_count], y0[:label_count], x1[:label_count], y1[:label_count], 96, 96)
+    labels = measure(lambda frame: labels_many(dimensions), frames)
+    result.update({"labels": label_count, "labels_p50_ms": labels["p50_ms"]})
+    return result
+
+def run(resolutions, measurements, frames, pairs=PAIRS):
+    app = QApplication.instance() or QApplication(sys.argv)
+    results = [bench_dimensions(pairs, min(frames, 20))]
+    for name in resolutions:
+        monitors = RESOLUTIONS[name]
+        results.append(bench_monitors(app, name, monitors, frames))
+        results.append(bench_background(app, name, monitors, frames))
+        results.append(bench_grid(app, name, monitors, frames))
+        results.append(bench_preview(app, name, monitors, frames))
+        for count in measurements:
+            results.append(bench_overlay(app, name, monitors, count, frames))
+            results.append(bench_measurement_queries(app, name, monitors, count, frames))
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Screen Ruler paint and capture benchmarks")
+    parser.add_argument("--resolutions", nargs="+", choices=list(RESOLUTIONS), default=list(RESOLUTIONS))
+    parser.add_argument("--measurements", nargs="+", type=int, default=MEASUREMENTS)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--pairs", type=int, default=PAIRS, help="point pairs for the measurement math benchmark")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    results = run(args.resolutions, args.measurements, args.frames, args.pairs)
+    write_results({"python": sys.version.split()[0], "results": results}, args.output)
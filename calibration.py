@@ -0,0 +1,43 @@
+import json
+import sys
+
+from paths import data_path
+
+# Settings confirmed in the options menu, saved for each monitor so the next
+# launch can fill the menu with them, or skip it altogether.
+# Stored as JSON in SCREENRULER_CALIBRATION, by default screenruler_calibration.json in the program's folder:
+# {monitor id: {"h_res", "v_res", "size", "ppix", "ppiy", "magnifier_size", "zoom", "snap_radius", "skip"}}
+# h_res, v_res and size are what was entered ("auto" when auto was checked),
+# ppix and ppiy are what the ruler ended up using.
+class CalibrationCache():
+    def __init__(self, path=None):
+        if path is None:
+            path = data_path("SCREENRULER_CALIBRATION", "screenruler_calibration.json")
+        self.path = path
+        self.calibrations = None
+
+    def load(self):
+        if self.calibrations is None:
+            try:
+                with open(self.path) as f:
+                    self.calibrations = json.load(f)
+            except (OSError, ValueError):
+                self.calibrations = {}
+        return self.calibrations
+
+    def get(self, screen):
+        return self.load().get(screen_id(screen))
+
+    def save(self, screen, calibration):
+        self.load()[screen_id(screen)] = calibration
+        try:
+            with open(self.path, "w") as f:
+                json.dump(self.calibrations, f, indent=2)
+        except OSError as e:
+            # The ruler works the same, the menu is just shown again next time
+            print("calibration not saved:", e, file=sys.stderr)
+
+def screen_id(screen):
+    # The same monitor keeps its name, model and resolution, a different one (or a new resolution) is calibrated again
+    geometry = screen.geometry()
+    return f"{screen.manufacturer()} {screen.model()} {screen.name()} {geometry.width()}x{geometry.height()}"
@@ -0,0 +1,308 @@
+import collections
+import importlib.util
+import sys
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# PIL and mss are only imported when a capture actually needs them, they are slow to import
+# and nothing has to be captured until the ruler is on screen
+has_mss = importlib.util.find_spec("mss") is not None
+
+# A capture source keeps the last grabbed monitor in a persistent buffer.
+# The magnifier only ever reads small windows of that buffer, so instead of
+# asking the OS for a 21x21 screenshot on every paint, the whole monitor is
+# grabbed at most once per frame tick (or when marked as damaged) and the
+# preview patch is served as a slice of it.
+#
+# When numpy is available the buffer is a (height, width, 3) RGB array and
+# region() returns a view into it (no copy). Without numpy the buffer is a
+# PIL image and region() falls back to Image.crop.
+class CaptureSource():
+    def __init__(self, frame_interval=1/60):
+        self.frame_interval = frame_interval
+        self.buffer = None
+        self.bbox = None
+        self.frame_id = 0
+        self.timestamp = 0
+        self.damaged = True
+        self.displayed_frame = 0
+        self.grab_time = None # Seconds it took to grab the current frame
+        self.error = None # Why the last grab failed, None when it worked
+        self.snapshot_result = None # (buffer, bbox) of the snapshot asked with request_snapshot
+        self.latencies = collections.deque(maxlen=600) # seconds from grab to first display
+
+    def grab(self, bbox):
+        # bbox = (left, top, right, bottom) in global screen coordinates
+        # Must return the pixels of that area in the buffer format
+        raise NotImplementedError
+
+    def snapshot(self, bbox):
+        # A grab of bbox that owns its pixels, kept when the capture grabs again
+        buffer = self.grab(tuple(int(i) for i in bbox))
+        if np is not None:
+            return np.array(buffer) # Packed copy, grabs can be views of a buffer that is reused
+        return buffer.copy()
+
+    def request_snapshot(self, bbox):
+        # Asks for a snapshot of bbox, take_snapshot() returns it once it has been grabbed
+        self.snapshot_result = self.grab_snapshot(self, bbox)
+
+    def take_snapshot(self):
+        # (buffer, bbox) of the requested snapshot, buffer is None when the grab failed.
+        # None while it hasn't been grabbed yet
+        result = self.snapshot_result
+        self.snapshot_result = None
+        return result
+
+    def grab_snapshot(self, source, bbox):
+        try:
+            return source.snapshot(bbox), bbox
+        except Exception as e:
+            self.set_error(e)
+            return None, bbox
+
+    def invalidate(self):
+        # Forces a new grab on the next update(), regardless of the frame tick
+        self.damaged = True
+
+    def update(self, bbox):
+        bbox = tuple(int(i) for i in bbox)
+        now = time.perf_counter()
+        if (self.damaged
+            or bbox != self.bbox
+            or now - self.timestamp >= self.frame_interval):
+                self.damaged = False
+                try:
+                    buffer = self.grab(bbox)
+                except Exception as e:
+                    # The last frame is kept, it's tried again on the next tick
+                    self.timestamp = now
+                    self.set_error(e)
+                    return self.buffer
+                self.set_error(None)
+                self.buffer = buffer
+                self.bbox = bbox
+                self.timestamp = now
+                self.grab_time = time.perf_counter() - now
+                self.frame_id += 1
+        return self.buffer
+
+    def set_error(self, error):
+        # Logged once, not on every failed grab
+        message = None if error is None else f"{type(error).__name__}: {error}"
+        if message is not None and message != self.error:
+            print("screen capture failed:", message, file=sys.stderr)
+        self.error = message
+
+    def region(self, left, top, right, bottom):
+        # Coordinates are global, the buffer starts at self.bbox[0], self.bbox[1]
+        # None when the current frame doesn't contain the region (no frame yet, another monitor...)
+        if (self.buffer is None
+            or left < self.bbox[0] or top < self.bbox[1]
+            or right > self.bbox[2] or bottom > self.bbox[3]):
+                return None
+        left, top = int(left - self.bbox[0]), int(top - self.bbox[1])
+        right, bottom = int(right - self.bbox[0]), int(bottom - self.bbox[1])
+        if np is not None:
+            return self.buffer[top:bottom, left:right]
+        else:
+            return self.buffer.crop((left, top, right, bottom))
+
+    def mark_displayed(self):
+        # Called when the current frame is painted, returns how long ago it was grabbed
+        # the first time it is displayed, None afterwards
+        if self.frame_id == self.displayed_frame:
+            return None
+        self.displayed_frame = self.frame_id
+        latency = time.perf_counter() - self.timestamp
+        self.latencies.append(latency)
+        return latency
+
+class PILCapture(CaptureSource):
+    def grab(self, bbox):
+        from PIL import ImageGrab
+        img = ImageGrab.grab(bbox=bbox, all_screens=True).convert("RGB")
+        return to_buffer(img)
+
+# mss keeps a persistent connection to the display server and reuses its
+# shared memory segment (XShm on X11, a DIB section on Windows) between grabs
+class MSSCapture(CaptureSource):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sct = None
+
+    def grab(self, bbox):
+        # mss has to be used from the thread that created it, so it's created on the first grab
+        if self.sct is None:
+            import mss
+            self.sct = mss.mss()
+        monitor = {"left": bbox[0], "top": bbox[1], "width": bbox[2]-bbox[0], "height": bbox[3]-bbox[1]}
+        shot = self.sct.grab(monitor)
+        if np is not None:
+            bgra = np.frombuffer(shot.bgra, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+            return bgra[:, :, 2::-1] # BGRA -> RGB view
+        from PIL import Image
+        return Image.frombytes("RGB", shot.size, shot.bgra, "raw", "BGRX")
+
+# Serves a fixed image instead of the screen, for tests and benchmarks.
+# image can be a PIL image or a (height, width, 3) array covering the whole
+# virtual desktop starting at (0, 0)
+class FakeCapture(CaptureSource):
+    def __init__(self, image, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.image = to_buffer(image)
+        self.grab_count = 0
+
+    def grab(self, bbox):
+        self.grab_count += 1
+        if np is not None:
+            return self.image[bbox[1]:bbox[3], bbox[0]:bbox[2]]
+        return self.image.crop(bbox)
+
+# A snapshot taken before, served like a capture that never grabs again.
+# The buffer covers bbox, usually the whole virtual desktop. frame_id is
+# negative so what is cached per frame (edges, color statistics) is never
+# mixed up with a live frame.
+class SnapshotCapture(CaptureSource):
+    def __init__(self, buffer, bbox, frame_id, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buffer = buffer
+        self.bbox = tuple(bbox)
+        self.frame_id = frame_id
+        self.timestamp = time.perf_counter()
+        self.damaged = False
+
+    def grab(self, bbox):
+        return self.buffer
+
+    def update(self, bbox):
+        return self.buffer
+
+# Grabs on a worker thread so a slow grab never blocks the GUI thread.
+# update() only asks the worker for a new grab (when damaged, when the
+# monitor changes or once per frame tick) and returns straight away with the
+# newest completed frame, which may be a frame old. A frame whose grab started
+# before the last invalidate() is followed by another grab, it may show what
+# was on screen before the change. The worker publishes every frame as one tuple
+# (buffer, bbox, grab time), so swapping the reference is atomic and the
+# reader never needs a lock: it can never see a buffer with another frame's bbox.
+# on_frame is called from the worker thread after every new frame.
+class ThreadedCapture(CaptureSource):
+    def __init__(self, source, on_frame=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.source = source
+        self.on_frame = on_frame
+        self.latest = None # (buffer, bbox, timestamp, frame number, grab time)
+        self.requested = None
+        self.request_time = 0 # When the worker was last asked for a grab
+        self.invalidated = 0 # When invalidate() was last called
+        self.snapshot_request = None # bbox of the snapshot to grab
+        self.wake = threading.Event()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="capture", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        frame = 0
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            if not self.running:
+                return
+            snapshot_request = self.snapshot_request
+            if snapshot_request is not None:
+                # Published like a frame, the GUI thread picks it up with take_snapshot
+                self.snapshot_request = None
+                self.snapshot_result = self.grab_snapshot(self.source, snapshot_request)
+                if self.on_frame is not None:
+                    self.on_frame()
+                continue
+            bbox = self.requested
+            start = time.perf_counter()
+            try:
+                buffer = self.source.grab(bbox)
+            except Exception as e:
+                # The worker keeps going, the next request grabs again. The error is
+                # shown by the magnifier, so it's repainted as if a frame arrived
+                self.set_error(e)
+            else:
+                self.set_error(None)
+                frame += 1
+                self.latest = (buffer, bbox, start, frame, time.perf_counter() - start)
+            if self.on_frame is not None:
+                self.on_frame()
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+
+    def request_snapshot(self, bbox):
+        # The source belongs to the worker thread, so the worker grabs it and the GUI
+        # thread never waits: the result comes with on_frame
+        if not self.thread.is_alive():
+            self.set_error(RuntimeError("the capture thread isn't running"))
+            self.snapshot_result = (None, bbox)
+            return
+        self.snapshot_result = None
+        self.snapshot_request = bbox
+        self.wake.set()
+
+    def invalidate(self):
+        super().invalidate()
+        self.invalidated = time.perf_counter()
+
+    def update(self, bbox):
+        bbox = tuple(int(i) for i in bbox)
+        now = time.perf_counter()
+        latest = self.latest
+        new_frame = latest is not None and latest[3] != self.frame_id
+        if new_frame:
+            self.buffer, self.bbox, self.timestamp, self.frame_id, self.grab_time = latest
+            if self.timestamp < self.invalidated:
+                self.damaged = True
+        # The frame tick isn't checked when a frame just arrived, the paint it triggers
+        # would ask for the next one and the worker would never rest
+        if (self.damaged
+            or bbox != self.requested
+            or not new_frame and now - self.request_time >= self.frame_interval):
+                self.requested = bbox
+                self.request_time = now
+                self.damaged = False
+                self.wake.set()
+        return self.buffer
+
+def create_capture_source(*args, threaded=True, on_frame=None, **kwargs):
+    if has_mss:
+        source = MSSCapture(*args, **kwargs)
+    else:
+        source = PILCapture(*args, **kwargs)
+    if threaded:
+        return ThreadedCapture(source, on_frame)
+    return source
+
+def to_buffer(img):
+    if np is None:
+        if is_pil_image(img):
+            return img.convert("RGB")
+        return img
+    if is_pil_image(img):
+        return np.asarray(img.convert("RGB"))
+    return img
+
+def mean_color(patch):
+    if np is not None:
+        average = patch.reshape(-1, patch.shape[-1]).mean(axis=0)
+    else:
+        from PIL import ImageStat
+        average = ImageStat.Stat(patch).mean
+    return [int(i) for i in average]
+
+def is_pil_image(img):
+    # Without importing PIL: if it hasn't been imported, img can't be one of its images
+    image_module = sys.modules.get("PIL.Image")
+    return image_module is not None and isinstance(img, image_module.Image)
@@ -0,0 +1,187 @@
+from PyQt5.QtCore import QPoint, QRect, Qt
+from PyQt5.QtGui import QColor, QFontMetrics
+
+from capture import np
+
+# Color statistics of any rectangle of a captured frame without reading all its pixels.
+# The frame is split in TILE x TILE blocks and, once per frame, the sum, sum of
+# squares, min and max of every block are computed. Summed-area tables
+# (integral images) of the block sums and squares give the total of all the
+# blocks inside a rectangle with 4 lookups, and only the pixels of the partial
+# blocks at its borders are read, so the cost depends on the rectangle's
+# perimeter and not on its area (a full 4K monitor is as cheap as a 100x100 area).
+# Summed-area tables of every pixel would make the borders free too, but
+# building them for a 4K frame takes several times longer than this.
+class ColorStats():
+    TILE = 16
+
+    def __init__(self, buffer, bbox):
+        self.buffer = buffer
+        self.bbox = bbox
+        height, width = buffer.shape[:2]
+        tiles_y, tiles_x = height // self.TILE, width // self.TILE
+        # Reduced in two steps (rows of blocks, then blocks) which is much faster than both axes at once
+        rows = buffer[:tiles_y * self.TILE, :tiles_x * self.TILE].reshape(tiles_y, self.TILE, tiles_x * self.TILE, 3)
+        squares = np.square(rows, dtype=np.uint16) # 255**2 fits
+        self.sums = summed_area(block_reduce(rows.sum(axis=1, dtype=np.uint32), tiles_x, self.TILE, np.sum))
+        self.squares = summed_area(block_reduce(squares.sum(axis=1, dtype=np.uint32), tiles_x, self.TILE, np.sum))
+        self.tile_min = block_reduce(rows.min(axis=1), tiles_x, self.TILE, np.min)
+        self.tile_max = block_reduce(rows.max(axis=1), tiles_x, self.TILE, np.max)
+
+    def rect(self, left, top, right, bottom):
+        # Statistics of the global rect (right and bottom exclusive), clipped to the frame. None if nothing is left
+        ox, oy = self.bbox[0], self.bbox[1]
+        height, width = self.buffer.shape[:2]
+        l, t = max(left - ox, 0), max(top - oy, 0)
+        r, b = min(right - ox, width), min(bottom - oy, height)
+        if l >= r or t >= b:
+            return None
+
+        # Blocks fully inside the rect, in tiles
+        tx0, ty0 = -(-l // self.TILE), -(-t // self.TILE)
+        tx1, ty1 = min(r // self.TILE, self.tile_min.shape[1]), min(b // self.TILE, self.tile_min.shape[0])
+        if tx0 < tx1 and ty0 < ty1:
+            total = area_sum(self.sums, tx0, ty0, tx1, ty1)
+            total_squares = area_sum(self.squares, tx0, ty0, tx1, ty1)
+            low = self.tile_min[ty0:ty1, tx0:tx1].min(axis=(0, 1))
+            high = self.tile_max[ty0:ty1, tx0:tx1].max(axis=(0, 1))
+            x0, y0, x1, y1 = tx0 * self.TILE, ty0 * self.TILE, tx1 * self.TILE, ty1 * self.TILE
+            # Above, below, left and right of the blocks
+            borders = (self.buffer[t:y0, l:r], self.buffer[y1:b, l:r],
+                       self.buffer[y0:y1, l:x0], self.buffer[y0:y1, x1:r])
+        else:
+            total = total_squares = np.zeros(3, dtype=np.int64)
+            low = np.full(3, 255, dtype=np.uint8)
+            high = np.zeros(3, dtype=np.uint8)
+            borders = (self.buffer[t:b, l:r],)
+        for region in borders:
+            if region.size:
+                region = region.reshape(-1, 3)
+                total = total + region.sum(axis=0, dtype=np.int64)
+                total_squares = total_squares + np.square(region, dtype=np.int64).sum(axis=0)
+                low = np.minimum(low, region.min(axis=0))
+                high = np.maximum(high, region.max(axis=0))
+
+        area = (r - l) * (b - t)
+        mean = total / area
+        variance = np.maximum(total_squares / area - mean**2, 0)
+        return {
+            "size": (r - l, b - t),
+            "mean": mean.tolist(), "std": np.sqrt(variance).tolist(),
+            "min": low.tolist(), "max": high.tolist()
+        }
+
+def block_reduce(rows, tiles_x, tile, reduce):
+    # (tiles_y, tiles_x * tile, 3) -> (tiles_y, tiles_x, 3)
+    return reduce(rows.reshape(rows.shape[0], tiles_x, tile, 3), axis=2)
+
+def summed_area(blocks):
+    # table[y, x] = sum of blocks[:y, :x]
+    table = np.zeros((blocks.shape[0] + 1, blocks.shape[1] + 1, 3), dtype=np.int64)
+    np.cumsum(blocks, axis=0, out=table[1:, 1:])
+    np.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+    return table
+
+def area_sum(table, l, t, r, b):
+    return table[b, r] - table[t, r] - table[b, l] + table[t, l]
+
+# Color inspection mode (C key): the color of the pixel under the cursor, and
+# the statistics of a rectangle dragged with the left button.
+# The tables of a frame are only built when a rectangle is dragged, and the
+# whole drag uses the frame that was on screen when it started. The ruler only
+# starts a selection on a freeze frame snapshot: a live frame has the overlay
+# in it (the dark background, triangles, panels), only the hole is clean.
+class ColorInspector():
+    LINES = 6
+
+    def __init__(self):
+        self.enabled = False
+        self.frame = None # (frame_id, bbox) of self.stats
+        self.stats = None
+        self.clear_selection()
+
+    def toggle(self):
+        self.enabled = not self.enabled and np is not None
+        self.clear_selection()
+
+    def clear_selection(self):
+        self.selection = None # [x0, y0, x1, y1] global, both corners included
+        self.selection_stats = None
+        self.result = None
+        self.dragging = False
+
+    def frame_stats(self, capture):
+        if capture.buffer is None:
+            return None
+        frame = (capture.frame_id, capture.bbox)
+        if frame != self.frame:
+            self.frame = frame
+            self.stats = ColorStats(capture.buffer, capture.bbox)
+        return self.stats
+
+    def start_selection(self, capture, x, y):
+        self.selection = [x, y, x, y]
+        self.selection_stats = self.frame_stats(capture)
+        self.dragging = True
+        self.update_selection(x, y)
+
+    def update_selection(self, x, y):
+        self.selection[2], self.selection[3] = x, y
+        if self.selection_stats is not None:
+            self.result = self.selection_stats.rect(*self.selection_bounds())
+
+    def end_selection(self):
+        self.dragging = False
+
+    def selection_bounds(self):
+        # left, top, right, bottom, right and bottom exclusive
+        x0, y0, x1, y1 = self.selection
+        return min(x0, x1), min(y0, y1), max(x0, x1) + 1, max(y0, y1) + 1
+
+    def pixel(self, capture, x, y):
+        patch = capture.region(x, y, x + 1, y + 1)
+        if patch is None or np is None:
+            return None
+        return tuple(int(i) for i in patch.reshape(-1)[:3])
+
+    def lines(self, pixel):
+        lines = []
+        if pixel is None:
+            lines.append("-")
+        else:
+            lines.append("#{:02X}{:02X}{:02X}  rgb({}, {}, {})".format(*pixel, *pixel))
+        if self.result is not None:
+            lines.append("area {} x {} px".format(*self.result["size"]))
+            for name in ("mean", "min", "max", "std"):
+                lines.append(f"{name:<4} " + " ".join(f"{value:5.1f}" for value in self.result[name]))
+        return lines
+
+    def panel_size(self, font):
+        metrics = QFontMetrics(font)
+        width = metrics.horizontalAdvance("#FFFFFF  rgb(255, 255, 255)") + metrics.height() + 30
+        height = metrics.height() * self.LINES + 10
+        return width, height
+
+    def paint_panel(self, painter, font, rect, pixel):
+        metrics = QFontMetrics(font)
+        painter.setFont(font)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor(0, 0, 0, 200))
+        painter.drawRect(rect)
+        swatch = metrics.height()
+        if pixel is not None:
+            painter.setPen(QColor(255, 255, 255))
+            painter.setBrush(QColor(*pixel))
+            painter.drawRect(rect.x() + 10, rect.y() + 5, swatch, swatch)
+        painter.setPen(QColor(255, 255, 255))
+        for index, line in enumerate(self.lines(pixel)):
+            x = rect.x() + 20 + swatch if index == 0 else rect.x() + 10
+            painter.drawText(QPoint(x, rect.y() + 5 + metrics.ascent() + index*metrics.height()), line)
+
+    def paint_selection(self, painter, origin):
+        if self.selection is None:
+            return
+        left, top, right, bottom = self.selection_bounds()
+        painter.setBrush(Qt.NoBrush)
+        painter.setPen(QColor(0, 255, 255))
+        painter.drawRect(QRect(left - origin[0], top - origin[1], right - left - 1, bottom - top - 1))
@@ -0,0 +1,49 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+INCH_TO_CM = 2.54
+
+# Size of the triangle from (x0, y0) to (x1, y1), as the ruler labels it.
+# Both ends are included in the horizontal and vertical sides (hence the + 1),
+# the hypotenuse is the distance between the two points.
+# Only uses operations that work the same on numbers and on numpy arrays, so
+# measure_many is this very function over N pairs at once.
+def measure(x0, y0, x1, y1, ppix, ppiy):
+    x_px = abs(x1 - x0) + 1
+    y_px = abs(y1 - y0) + 1
+    hip_px = ((x1 - x0)**2 + (y1 - y0)**2) ** 0.5
+    x_inches = x_px / ppix
+    y_inches = y_px / ppiy
+    hip_inches = hip_px / ((ppix + ppiy)/2)
+    return {
+        "x_px": x_px, "y_px": y_px, "hip_px": hip_px,
+        "x_inches": x_inches, "y_inches": y_inches, "hip_inches": hip_inches,
+        "x_cm": x_inches * INCH_TO_CM, "y_cm": y_inches * INCH_TO_CM, "hip_cm": hip_inches * INCH_TO_CM
+    }
+
+def measure_many(x0, y0, x1, y1, ppix, ppiy):
+    # Same as measure, every argument can be a sequence (or numpy array) of N values or a single value for all of them
+    # int64 so the squares can't overflow
+    coords = [np.asarray(c, dtype=np.int64) for c in (x0, y0, x1, y1)]
+    return measure(*coords, np.asarray(ppix, dtype=np.float64), np.asarray(ppiy, dtype=np.float64))
+
+def format_labels(x_px, y_px, hip_px, x_cm, y_cm, hip_cm, x_inches, y_inches, hip_inches):
+    # in 7.2f -> 7 = max char, 2 = max floating point precision
+    x_text = str(x_px) + "px | " + f"{x_cm:7.2f}" + "cm | " + f"{x_inches:7.2f}" + "inch"
+    y_text = str(y_px) + "px | " + f"{y_cm:7.2f}" + "cm | " + f"{y_inches:7.2f}" + "inch"
+    hip_text = f"{hip_px:7.2f}" + "px | " + f"{hip_cm:7.2f}" + "cm | " + f"{hip_inches:7.2f}" + "inch"
+    return x_text, y_text, hip_text
+
+LABEL_KEYS = ("x_px", "y_px", "hip_px", "x_cm", "y_cm", "hip_cm", "x_inches", "y_inches", "hip_inches")
+
+def labels(dimensions):
+    return format_labels(*(dimensions[key] for key in LABEL_KEYS))
+
+def labels_many(dimensions):
+    # (x_text, y_text, hip_text) of each pair measured by measure_many
+    # tolist() turns the columns into python numbers in one go, so the texts are the same as labels()
+    count = max(np.size(dimensions[key]) for key in LABEL_KEYS)
+    columns = [np.broadcast_to(dimensions[key], (count,)).tolist() for key in LABEL_KEYS]
+    return [format_labels(*row) for row in zip(*columns)]
@@ -0,0 +1,87 @@
+from capture import np
+
+# Snaps points to the closest strong edge of the captured screen.
+# The gradient magnitude of the luminance (central differences) is computed
+# with numpy in TILE x TILE tiles, only for the tiles around the points that
+# are snapped, and kept until the capture grabs a new frame. So each pixel's
+# gradient is computed at most once per frame no matter how many mouse
+# events ask for it, and a 4K frame is never processed as a whole.
+class EdgeSnapper():
+    TILE = 64
+
+    def __init__(self, radius=8, threshold=48):
+        self.enabled = False
+        self.radius = radius
+        self.threshold = threshold # Minimum luminance difference (0-255) to be an edge
+        self.frame = None # (frame_id, bbox) the tiles belong to
+        self.tiles = {}
+        self.last_snap = None
+
+    def toggle(self):
+        self.enabled = not self.enabled and np is not None
+
+    def snap(self, capture, x, y, limit=None):
+        # (x, y) global, returns the global position of the closest edge pixel within radius
+        # (or limit if it's smaller), or (x, y) itself when snapping is off or there is no edge around
+        if not self.enabled or capture.buffer is None:
+            return x, y
+        radius = self.radius if limit is None else min(self.radius, limit)
+        frame = (capture.frame_id, capture.bbox)
+        if frame != self.frame:
+            self.frame = frame
+            self.tiles = {}
+            self.last_snap = None
+        if self.last_snap is not None and self.last_snap[0] == (x, y, radius, self.threshold):
+            return self.last_snap[1]
+
+        left = max(x - radius, capture.bbox[0])
+        top = max(y - radius, capture.bbox[1])
+        right = min(x + radius + 1, capture.bbox[2])
+        bottom = min(y + radius + 1, capture.bbox[3])
+        result = (x, y)
+        if left < right and top < bottom:
+            magnitude = self.gradient(capture, left, top, right, bottom)
+            ys, xs = np.nonzero(magnitude >= self.threshold)
+            if len(xs):
+                distances = (xs + left - x)**2 + (ys + top - y)**2
+                inside = distances <= radius**2
+                if inside.any():
+                    xs, ys, distances = xs[inside], ys[inside], distances[inside]
+                    # Closest first, the strongest edge if several are as close
+                    best = np.lexsort((-magnitude[ys, xs], distances))[0]
+                    result = (int(xs[best]) + left, int(ys[best]) + top)
+        self.last_snap = ((x, y, radius, self.threshold), result)
+        return result
+
+    def gradient(self, capture, left, top, right, bottom):
+        # Gradient magnitude of the global rect, assembled from the cached tiles
+        ox, oy = capture.bbox[0], capture.bbox[1]
+        magnitude = np.empty((bottom - top, right - left), dtype=np.float32)
+        for ty in range((top - oy) // self.TILE, (bottom - 1 - oy) // self.TILE + 1):
+            for tx in range((left - ox) // self.TILE, (right - 1 - ox) // self.TILE + 1):
+                tile = self.tiles.get((tx, ty))
+                if tile is None:
+                    tile = self.tiles[(tx, ty)] = tile_gradient(capture.buffer, tx * self.TILE, ty * self.TILE, self.TILE)
+                # Overlap between the tile and the rect, in frame coordinates
+                tile_left, tile_top = tx * self.TILE, ty * self.TILE
+                x0, x1 = max(left - ox, tile_left), min(right - ox, tile_left + tile.shape[1])
+                y0, y1 = max(top - oy, tile_top), min(bottom - oy, tile_top + tile.shape[0])
+                magnitude[y0 - (top - oy):y1 - (top - oy), x0 - (left - ox):x1 - (left - ox)] = \
+                    tile[y0 - tile_top:y1 - tile_top, x0 - tile_left:x1 - tile_left]
+        return magnitude
+
+def luminance(pixels):
+    pixels = pixels.astype(np.float32)
+    return pixels[..., 0]*0.299 + pixels[..., 1]*0.587 + pixels[..., 2]*0.114
+
+def tile_gradient(buffer, left, top, size):
+    height, width = buffer.shape[:2]
+    right, bottom = min(left + size, width), min(top + size, height)
+    # 1 pixel of margin for the central differences, repeating the border of the frame
+    pad_left, pad_top = min(left, 1), min(top, 1)
+    pad_right, pad_bottom = min(width - right, 1), min(height - bottom, 1)
+    lum = luminance(buffer[top - pad_top:bottom + pad_bottom, left - pad_left:right + pad_right])
+    lum = np.pad(lum, ((1 - pad_top, 1 - pad_bottom), (1 - pad_left, 1 - pad_right)), mode="edge")
+    gx = lum[1:-1, 2:] - lum[1:-1, :-2]
+    gy = lum[2:, 1:-1] - lum[:-2, 1:-1]
+    return np.hypot(gx, gy)
@@ -0,0 +1,99 @@
+import math
+import os
+
+from PyQt5.QtCore import QLine, QRect, Qt
+from PyQt5.QtGui import QBrush, QColor, QPainter, QPixmap
+
+# Alignment aids drawn over the whole overlay: a pixel grid (vertical and horizontal
+# lines every spacing pixels), a baseline grid (only the horizontal lines) and guide
+# lines added where the cursor is.
+# The grids are not drawn line by line: the repainted area is filled with a brush
+# made from a tile that already has the lines of a few cells, so a whole 4K screen
+# is a single textured fill. The tile is only drawn again when the mode, the
+# spacing or the color change. The starting spacing is SCREENRULER_GRID_SPACING,
+# 8 pixels by default.
+class GridOverlay():
+    OFF, PIXEL, BASELINE = 0, 1, 2
+    SPACINGS = (4, 8, 10, 16, 32)
+    TILE = 128 # Minimum side of the tile, it's rounded up to a multiple of the spacing
+
+    def __init__(self, spacing=None, color=QColor(0, 200, 255, 90), guide_color=QColor(255, 0, 255, 180)):
+        if spacing is None:
+            spacing = int(os.environ.get("SCREENRULER_GRID_SPACING", "8"))
+        self.mode = self.OFF
+        self.spacing = max(spacing, 2)
+        self.color = color
+        self.guide_color = guide_color
+        self.horizontal = [] # y of each horizontal guide, relative to the ruler window
+        self.vertical = [] # x of each vertical guide
+        self.brush = None
+        self.brush_key = None # (mode, spacing, color) the brush was made for
+        self.lines = None
+        self.lines_key = None # (guides, width, height) the lines were made for
+
+    def cycle_mode(self):
+        # Off -> pixel grid -> baseline grid -> off
+        self.mode = (self.mode + 1) % 3
+
+    def next_spacing(self):
+        bigger = [spacing for spacing in self.SPACINGS if spacing > self.spacing]
+        self.spacing = bigger[0] if bigger else self.SPACINGS[0]
+
+    def visible(self):
+        return self.mode != self.OFF or self.horizontal or self.vertical
+
+    def tile_brush(self):
+        key = (self.mode, self.spacing, self.color.rgba())
+        if key != self.brush_key:
+            self.brush_key = key
+            self.brush = QBrush(self.generate_tile())
+        return self.brush
+
+    def generate_tile(self):
+        side = math.ceil(self.TILE / self.spacing) * self.spacing
+        tile = QPixmap(side, side)
+        tile.fill(Qt.transparent)
+        painter = QPainter(tile)
+        # Where lines cross the pixel has the line's alpha, not twice
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        painter.setPen(self.color)
+        for position in range(0, side, self.spacing):
+            painter.drawLine(0, position, side - 1, position)
+            if self.mode == self.PIXEL:
+                painter.drawLine(position, 0, position, side - 1)
+        painter.end()
+        return tile
+
+    def toggle_guide(self, vertical, position, width, height):
+        # Adds a guide at position, or removes the one that is there. Returns the area to repaint
+        guides = self.vertical if vertical else self.horizontal
+        close = [guide for guide in guides if abs(guide - position) <= 2]
+        if close:
+            guides.remove(close[0])
+            position = close[0]
+        else:
+            guides.append(position)
+        if vertical:
+            return QRect(position, 0, 1, height)
+        return QRect(0, position, width, 1)
+
+    def guide_lines(self, width, height):
+        key = (tuple(self.horizontal), tuple(self.vertical), width, height)
+        if key != self.lines_key:
+            self.lines_key = key
+            self.lines = [QLine(0, y, width - 1, y) for y in self.horizontal]
+            self.lines += [QLine(x, 0, x, height - 1) for x in self.vertical]
+        return self.lines
+
+    def paint(self, painter, region, width, height):
+        # region: area of the overlay being repainted, the lines are only drawn there
+        if self.mode != self.OFF:
+            brush = self.tile_brush()
+            for rect in region.rects():
+                painter.fillRect(rect, brush)
+        if self.horizontal or self.vertical:
+            painter.save()
+            painter.setClipRegion(region)
+            painter.setPen(self.guide_color)
+            painter.drawLines(self.guide_lines(width, height))
+            painter.restore()
@@ -0,0 +1,129 @@
+import collections
+import json
+import os
+import sys
+import time
+
+from PyQt5.QtCore import QPoint, QRect, Qt
+from PyQt5.QtGui import QColor, QFontMetrics
+
+from paths import data_path
+
+PHASES = ["grab", "capture", "magnifier", "background", "measurements", "text", "latency"]
+
+# Times each phase of every frame when enabled (SCREENRULER_PROFILE=1 or the I key).
+# grab and latency aren't phases of the frame: grab is how long the capture source took
+# to grab the frame (on its worker thread when threaded), latency how long the frame
+# took to be displayed once grabbed.
+# The last HISTORY samples of each phase are kept to show p50/p99 in a HUD, and
+# every sample is also kept as a trace that is written on exit in the Chrome
+# trace format (chrome://tracing, Perfetto) to SCREENRULER_TRACE, by default
+# screenruler_trace.json in the program's folder
+class FrameProfiler():
+    HISTORY = 600
+    MAX_TRACE_EVENTS = 500000
+
+    def __init__(self, enabled=None, trace_path=None):
+        if enabled is None:
+            enabled = os.environ.get("SCREENRULER_PROFILE", "0") not in ("", "0")
+        if trace_path is None:
+            trace_path = data_path("SCREENRULER_TRACE", "screenruler_trace.json")
+        self.enabled = enabled
+        self.trace_path = trace_path
+        self.frame = 0
+        self.history = {phase: collections.deque(maxlen=self.HISTORY) for phase in PHASES}
+        self.trace = collections.deque(maxlen=self.MAX_TRACE_EVENTS)
+        self.origin = time.perf_counter()
+        self.null_phase = NullPhase()
+
+    def toggle(self):
+        self.enabled = not self.enabled
+
+    def new_frame(self):
+        self.frame += 1
+
+    def phase(self, name):
+        # with profiler.phase("capture"): ...
+        if not self.enabled:
+            return self.null_phase
+        return Phase(self, name)
+
+    def record(self, name, start, duration):
+        self.history[name].append(duration)
+        self.trace.append((name, self.frame, start - self.origin, duration))
+
+    def record_grab(self, start, duration):
+        if self.enabled and duration is not None:
+            self.record("grab", start, duration)
+
+    def record_latency(self, latency):
+        # Time between a capture being grabbed and it being displayed
+        if self.enabled:
+            self.record("latency", time.perf_counter() - latency, latency)
+
+    def percentiles(self, name):
+        samples = sorted(self.history[name])
+        if not samples:
+            return None, None
+        return samples[len(samples)//2], samples[min(len(samples)-1, int(len(samples)*0.99))]
+
+    def hud_lines(self):
+        lines = ["phase          p50 ms   p99 ms"]
+        for name in PHASES:
+            p50, p99 = self.percentiles(name)
+            if p50 is None:
+                lines.append(f"{name:<12}        -        -")
+            else:
+                lines.append(f"{name:<12} {p50*1000:8.3f} {p99*1000:8.3f}")
+        return lines
+
+    def hud_rect(self, font, extra_lines=0):
+        metrics = QFontMetrics(font)
+        width = metrics.horizontalAdvance("measurements 99999.999 99999.999") + 20
+        height = metrics.height() * (len(PHASES) + 1 + extra_lines) + 10
+        return QRect(10, 10, width, height)
+
+    def paint_hud(self, painter, font, extra_lines=(), rect=None):
+        # extra_lines: other counters to show under the phases
+        if rect is None:
+            rect = self.hud_rect(font, len(extra_lines))
+        painter.setFont(font)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor(0, 0, 0, 200))
+        painter.drawRect(rect)
+        painter.setPen(QColor(0, 255, 0))
+        metrics = QFontMetrics(font)
+        for index, line in enumerate(self.hud_lines() + list(extra_lines)):
+            painter.drawText(QPoint(rect.x() + 10, rect.y() + 5 + metrics.ascent() + index*metrics.height()), line)
+
+    def dump(self):
+        if not self.trace:
+            return
+        events = []
+        for name, frame, start, duration in self.trace:
+            events.append({"name": name, "ph": "X", "pid": 0, "tid": 0,
+                           "ts": start * 1e6, "dur": duration * 1e6, "args": {"frame": frame}})
+        try:
+            with open(self.trace_path, "w") as f:
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        except OSError as e:
+            print("trace not saved:", e, file=sys.stderr)
+
+class Phase():
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.record(self.name, self.start, time.perf_counter() - self.start)
+
+class NullPhase():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
@@ -0,0 +1,58 @@
+import collections
+import os
+
+from PyQt5.QtGui import QStaticText, QTransform
+
+# Bounded LRU cache of laid out label texts, shared by every label of the ruler.
+# A QStaticText keeps its text layout, so drawing one again skips text shaping,
+# but only if the same object is reused: this cache hands out the same
+# QStaticText for the same text and font.
+# Entries are looked up by a key describing what the text shows: the values the
+# text is formatted from (see RulerWindow.label_keys) or the text itself, so
+# on a hit nothing has to be formatted either.
+# The size is SCREENRULER_LABEL_CACHE entries, 4096 by default.
+class LabelCache():
+    def __init__(self, size=None):
+        if size is None:
+            size = int(os.environ.get("SCREENRULER_LABEL_CACHE", "4096"))
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, keys, font, make_texts):
+        # QStaticTexts for keys, make_texts() returns the texts of all of them and is only called on a miss
+        font_key = font.key()
+        statics = []
+        texts = None
+        for index, key in enumerate(keys):
+            entry_key = (key, font_key)
+            static = self.entries.get(entry_key)
+            if static is not None:
+                self.hits += 1
+                self.entries.move_to_end(entry_key)
+            else:
+                self.misses += 1
+                if texts is None:
+                    texts = make_texts()
+                static = QStaticText(texts[index])
+                static.setPerformanceHint(QStaticText.AggressiveCaching)
+                static.prepare(QTransform(), font)
+                self.entries[entry_key] = static
+                if len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+            statics.append(static)
+        return statics
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries), "size": self.size,
+                "hit_rate": self.hits / total if total else None}
+
+    def hud_line(self):
+        total = self.hits + self.misses
+        rate = f"{self.hits / total * 100:5.1f}%" if total else "    -"
+        return f"labels {rate} {len(self.entries):>5}/{self.size}"
@@ -1,16 +1,45 @@
 #pyinstaller main.py -n screenruler -w -i ruler.ico
+# python main.py --settings shows the options menu even if it was skipped for this monitor
+import time
+START = time.perf_counter()
+
+import json
+import os
 import sys
 from PyQt5.QtWidgets import QApplication, QLabel, QMainWindow, QGridLayout, QWidget, QLineEdit, QPushButton, QCheckBox
-from PyQt5.QtCore import QSize, Qt
+from PyQt5.QtCore import QEvent, QObject, QSize, Qt, QTimer
 from PyQt5.QtGui import QFont, QIcon
 
-from screenruler import RulerWindow
+from calibration import CalibrationCache
+from paths import data_path
+
+# The ruler (and with it numpy, the capture and everything else) is only imported
+# once the options menu is on screen, or straight away when the menu is skipped
+def create_ruler():
+    from screenruler import RulerWindow
+    from session import SessionLog
+    return RulerWindow(session=SessionLog(data_path("SCREENRULER_SESSION", "screenruler_session.log")))
+
+def start_ruler(ruler, calibration):
+    ruler.set_sizes(calibration["h_res"], calibration["v_res"], calibration["size"])
+    size = int(calibration["magnifier_size"])
+    ruler.set_magnifier((size, size), int(calibration["zoom"]))
+    ruler.snapper.radius = int(calibration["snap_radius"])
+    calibration["ppix"], calibration["ppiy"] = ruler.ppix, ruler.ppiy
+    ruler.showFullScreen()
+    if os.environ.get("SCREENRULER_RECORD"):
+        # Input recording to replay it later with replay.py
+        from replay import Recorder
+        ruler.recorder = Recorder(ruler, os.environ["SCREENRULER_RECORD"])
 
 class SettingsWindow(QMainWindow):
-    def __init__(self, ruler, *args, **kwargs):
+    def __init__(self, calibrations, screen, *args, **kwargs):
         super(SettingsWindow, self).__init__(*args, **kwargs)
 
-        self.ruler = ruler
+        self.ruler = None
+        self.calibrations = calibrations
+        self.screen_to_calibrate = screen
+        saved = calibrations.get(screen)
 
         self.setWindowTitle("Screen Ruler")
         app_icon = QIcon("ruler.ico")
@@ -45,6 +74,8 @@ class SettingsWindow(QMainWindow):
             self.input_layout.addWidget(label, index, 0)
     
         default_values = ["1920", "1080", "23"]
+        if saved is not None and saved["h_res"] != "auto":
+            default_values = [saved["h_res"], saved["v_res"], saved["size"]]
         fields = []
         for index, value in enumerate(default_values):
             input_field = QLineEdit(value)
@@ -53,13 +84,57 @@ class SettingsWindow(QMainWindow):
             fields.append(input_field)
             self.input_layout.addWidget(input_field, index, 1, Qt.AlignLeft)
         
+        magnifier_widget = QWidget()
+        magnifier_layout = QGridLayout(magnifier_widget)
+        magnifier_layout.setContentsMargins(0, 0, 0, 35)
+        central_widget.addWidget(magnifier_widget, 3, 0)
+
+        texts = ["magnifier size (in pixels): ", "magnifier zoom: ", "edge snap radius (in pixels): "]
+        # The magnifier size is filled in create_ruler, the default comes from the preview
+        default_values = ["", "7", "8"]
+        if saved is not None:
+            default_values = [saved["magnifier_size"], saved["zoom"], saved["snap_radius"]]
+        self.magnifier_fields = []
+        for index, (text, value) in enumerate(zip(texts, default_values)):
+            label = QLabel(text)
+            magnifier_layout.addWidget(label, index, 0)
+            input_field = QLineEdit(value)
+            input_field.setMaximumSize(80, 20)
+            self.magnifier_fields.append(input_field)
+            magnifier_layout.addWidget(input_field, index, 1, Qt.AlignLeft)
+
+        skip_widget = QWidget()
+        skip_layout = QGridLayout(skip_widget)
+        skip_layout.setContentsMargins(0, 0, 0, 10)
+        skip_label = QLabel("Don't show this menu again for this monitor")
+        self.skip_checkbox = QCheckBox()
+        skip_layout.addWidget(self.skip_checkbox, 0, 0)
+        skip_layout.addWidget(skip_label, 0, 1, Qt.AlignLeft)
+        central_widget.addWidget(skip_widget, 4, 0)
+
         confirm_button = QPushButton("confirm")
         confirm_button.clicked.connect(lambda: self.start_ruler(fields))
-        central_widget.addWidget(confirm_button, 3, 0, Qt.AlignCenter)
+        central_widget.addWidget(confirm_button, 5, 0, Qt.AlignCenter)
+
+        if saved is None or saved["h_res"] == "auto":
+            self.auto_checkbox.click()
+
+    def paintEvent(self, event):
+        super(SettingsWindow, self).paintEvent(event)
+        if self.ruler is None:
+            # Load the ruler while the user reads the menu, once it's on screen
+            QTimer.singleShot(0, self.create_ruler)
 
-        self.auto_checkbox.click()
+    def create_ruler(self):
+        if self.ruler is not None:
+            return
+        self.ruler = create_ruler()
+        if not self.magnifier_fields[0].text():
+            from preview import Preview
+            self.magnifier_fields[0].setText(str(Preview.M_SIZE[0]))
 
     def start_ruler(self, fields):
+        self.create_ruler()
         if self.auto_checkbox.isChecked():
             h_res = "auto"
             v_res = "auto"
@@ -68,8 +143,15 @@ class SettingsWindow(QMainWindow):
             h_res = fields[0].text()
             v_res = fields[1].text()
             size = fields[2].text()
-        self.ruler.set_sizes(h_res, v_res, size)
-        self.ruler.showFullScreen()
+        calibration = {
+            "h_res": h_res, "v_res": v_res, "size": size,
+            "magnifier_size": self.magnifier_fields[0].text(),
+            "zoom": self.magnifier_fields[1].text(),
+            "snap_radius": self.magnifier_fields[2].text(),
+            "skip": self.skip_checkbox.isChecked()
+        }
+        start_ruler(self.ruler, calibration)
+        self.calibrations.save(self.screen_to_calibrate, calibration)
         self.hide()
 
     def toggle_auto(self, state):
@@ -87,12 +169,41 @@ class CentralWidget(QWidget):
     def addWidget(self, widget, row, col, *args):
         self.layout.addWidget(widget, row, col, *args)
 
-if __name__ == "__main__":
-    app = QApplication(sys.argv)
+# SCREENRULER_STARTUP_TIMING=1 prints how long it took from launch until the first window was painted, then exits
+class FirstFrameTimer(QObject):
+    def __init__(self, window, name, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.name = name
+        window.installEventFilter(self)
 
-    ruler = RulerWindow()
-    window = SettingsWindow(ruler)
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Paint:
+            watched.removeEventFilter(self)
+            # Once the paint event has been processed
+            QTimer.singleShot(0, self.report)
+        return False
 
-    window.show()
+    def report(self):
+        print(json.dumps({"window": self.name, "first_frame_ms": (time.perf_counter() - START) * 1000}), flush=True)
+        QApplication.instance().quit()
+
+if __name__ == "__main__":
+    app = QApplication(sys.argv)
+    timing = os.environ.get("SCREENRULER_STARTUP_TIMING", "0") not in ("", "0")
+
+    calibrations = CalibrationCache()
+    screen = app.primaryScreen()
+    saved = calibrations.get(screen)
+    if saved is not None and saved.get("skip") and "--settings" not in sys.argv:
+        # Calibrated before, straight to measuring
+        ruler = create_ruler()
+        if timing:
+            timer = FirstFrameTimer(ruler, "ruler")
+        start_ruler(ruler, saved)
+    else:
+        window = SettingsWindow(calibrations, screen)
+        if timing:
+            timer = FirstFrameTimer(window, "settings")
+        window.show()
 
     app.exec_()
\ No newline at end of file
@@ -0,0 +1,243 @@
+import math
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class Measurement():
+    __slots__ = ("id", "x0", "y0", "x1", "y1")
+
+    def __init__(self, id, x0, y0, x1, y1):
+        self.id = id
+        self.x0, self.y0 = x0, y0
+        self.x1, self.y1 = x1, y1
+
+# Finished measurements, stored as parallel arrays (one entry per measurement)
+# plus a uniform grid that maps each CELL x CELL square of the screen to the
+# measurements whose bounding rect touches it.
+# Ids never change, removing a measurement only marks it as dead and takes it
+# out of the grid.
+class MeasurementStore():
+    CELL = 256
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # start (x0, y0) and end (x1, y1) of each measurement
+        self.x0, self.y0 = array("i"), array("i")
+        self.x1, self.y1 = array("i"), array("i")
+        # Bounding rect of everything drawn for the measurement, right and bottom are exclusive
+        self.left, self.top = array("i"), array("i")
+        self.right, self.bottom = array("i"), array("i")
+        self.alive = bytearray()
+        self.alive_count = 0
+        self.labels = [] # Texts drawn for each measurement, None until someone computes them
+        self.cells = {} # (cell x, cell y) -> list of ids
+
+    def clear_labels(self):
+        # The texts are computed again the next time they are needed
+        self.labels = [None] * len(self.alive)
+
+    def __len__(self):
+        return self.alive_count
+
+    def __iter__(self):
+        for id in range(len(self.alive)):
+            if self.alive[id]:
+                yield self.get(id)
+
+    def get(self, id):
+        return Measurement(id, self.x0[id], self.y0[id], self.x1[id], self.y1[id])
+
+    def bounds(self, id):
+        return self.left[id], self.top[id], self.right[id], self.bottom[id]
+
+    def add(self, x0, y0, x1, y1, bounds=None):
+        if bounds is None:
+            bounds = (min(x0, x1), min(y0, y1), max(x0, x1) + 1, max(y0, y1) + 1)
+        id = len(self.alive)
+        self.x0.append(x0)
+        self.y0.append(y0)
+        self.x1.append(x1)
+        self.y1.append(y1)
+        self.left.append(bounds[0])
+        self.top.append(bounds[1])
+        self.right.append(bounds[2])
+        self.bottom.append(bounds[3])
+        self.alive.append(1)
+        self.alive_count += 1
+        self.labels.append(None)
+        for cell in self.cells_of(*bounds):
+            self.cells.setdefault(cell, []).append(id)
+        return id
+
+    def extend(self, x0, y0, x1, y1, left, top, right, bottom, alive):
+        # Adds many measurements at once (lists of ints, one per measurement), with consecutive ids
+        first = len(self.alive)
+        self.x0.extend(x0)
+        self.y0.extend(y0)
+        self.x1.extend(x1)
+        self.y1.extend(y1)
+        self.left.extend(left)
+        self.top.extend(top)
+        self.right.extend(right)
+        self.bottom.extend(bottom)
+        self.alive.extend(1 if a else 0 for a in alive)
+        self.labels.extend([None] * len(x0))
+        if np is None:
+            for id in range(first, len(self.alive)):
+                if self.alive[id]:
+                    self.alive_count += 1
+                    for cell in self.cells_of(*self.bounds(id)):
+                        self.cells.setdefault(cell, []).append(id)
+            return
+        ids = first + np.flatnonzero(np.frombuffer(self.alive, dtype=np.uint8)[first:])
+        self.alive_count += len(ids)
+        self.add_to_cells(ids)
+
+    def add_to_cells(self, ids):
+        # cells_of for many ids at once: one (cell, id) pair per cell each id touches,
+        # sorted by cell (and by id within a cell) so every cell gets its ids in one go
+        left = np.frombuffer(self.left, dtype=np.intc)[ids] // self.CELL
+        top = np.frombuffer(self.top, dtype=np.intc)[ids] // self.CELL
+        width = (np.frombuffer(self.right, dtype=np.intc)[ids] - 1) // self.CELL - left + 1
+        height = (np.frombuffer(self.bottom, dtype=np.intc)[ids] - 1) // self.CELL - top + 1
+        counts = width * height
+        owner = np.repeat(np.arange(len(ids)), counts)
+        if not len(owner):
+            return
+        # Index of each pair among the cells of its id
+        index = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+        cx = left[owner] + index % width[owner]
+        cy = top[owner] + index // width[owner]
+        # Cells numbered from 0 inside the block they cover, a stable sort keeps the ids in order
+        min_x, min_y = cx.min(), cy.min()
+        rows = cy.max() - min_y + 1
+        cell = (cx - min_x) * rows + (cy - min_y)
+        if cell.max() < 65536:
+            # numpy sorts 16 bit numbers with a radix sort
+            cell = cell.astype(np.uint16)
+        order = np.argsort(cell, kind="stable")
+        cell, pair_ids = cell[order], ids[owner[order]].tolist()
+        starts = np.flatnonzero(np.r_[True, cell[1:] != cell[:-1]])
+        ends = np.r_[starts[1:], len(cell)].tolist()
+        for start, end, number in zip(starts.tolist(), ends, cell[starts].tolist()):
+            x, y = divmod(number, rows)
+            self.cells.setdefault((int(min_x + x), int(min_y + y)), []).extend(pair_ids[start:end])
+
+    def remove_all(self):
+        # Ids of the measurements that were removed
+        ids = [id for id in range(len(self.alive)) if self.alive[id]]
+        self.alive = bytearray(len(self.alive))
+        self.alive_count = 0
+        self.labels = [None] * len(self.alive)
+        self.cells = {}
+        return ids
+
+    def restore(self, id):
+        # Brings back a removed measurement, with the same id
+        if self.alive[id]:
+            return
+        self.alive[id] = 1
+        self.alive_count += 1
+        for cell in self.cells_of(*self.bounds(id)):
+            self.cells.setdefault(cell, []).append(id)
+
+    def remove(self, id):
+        if not self.alive[id]:
+            return
+        self.alive[id] = 0
+        self.alive_count -= 1
+        self.labels[id] = None
+        for cell in self.cells_of(*self.bounds(id)):
+            ids = self.cells[cell]
+            ids.remove(id)
+            if not ids:
+                del self.cells[cell]
+
+    def cells_of(self, left, top, right, bottom):
+        for cx in range(left // self.CELL, (right - 1) // self.CELL + 1):
+            for cy in range(top // self.CELL, (bottom - 1) // self.CELL + 1):
+                yield (cx, cy)
+
+    def query_rect(self, left, top, right, bottom):
+        # Ids of the measurements whose bounding rect intersects the rect, in the order they were added
+        found = set()
+        for cell in self.cells_of(left, top, right, bottom):
+            for id in self.cells.get(cell, ()):
+                if (self.left[id] < right and left < self.right[id]
+                    and self.top[id] < bottom and top < self.bottom[id]):
+                        found.add(id)
+        return sorted(found)
+
+    def distance(self, id, x, y):
+        # Distance from (x, y) to the closest side of the measurement's triangle
+        x0, y0, x1, y1 = self.x0[id], self.y0[id], self.x1[id], self.y1[id]
+        return min(segment_distance(x, y, x0, y0, x1, y0),
+                   segment_distance(x, y, x1, y0, x1, y1),
+                   segment_distance(x, y, x1, y1, x0, y0))
+
+    def hit_test(self, x, y, tolerance=5):
+        # Measurement drawn under (x, y), the newest one wins
+        best = None
+        best_distance = tolerance
+        for id in self.cells.get((x // self.CELL, y // self.CELL), ()):
+            distance = self.distance(id, x, y)
+            if distance <= best_distance:
+                best, best_distance = id, distance
+        return best
+
+    def nearest(self, x, y, max_distance=math.inf):
+        # Closest measurement to (x, y), searching the grid in rings around its cell
+        if not self.cells:
+            return None
+        cx, cy = x // self.CELL, y // self.CELL
+        min_cx = min(cell[0] for cell in self.cells)
+        max_cx = max(cell[0] for cell in self.cells)
+        min_cy = min(cell[1] for cell in self.cells)
+        max_cy = max(cell[1] for cell in self.cells)
+        max_ring = max(cx - min_cx, max_cx - cx, cy - min_cy, max_cy - cy)
+
+        best = None
+        best_distance = max_distance
+        checked = set()
+        for ring in range(max_ring + 1):
+            # Anything in this ring or further is outside the block of cells already searched
+            if ring > 0:
+                inner_left = (cx - ring + 1) * self.CELL
+                inner_top = (cy - ring + 1) * self.CELL
+                inner_right = (cx + ring) * self.CELL
+                inner_bottom = (cy + ring) * self.CELL
+                if min(x - inner_left, inner_right - x, y - inner_top, inner_bottom - y) > best_distance:
+                    break
+            for cell in ring_cells(cx, cy, ring):
+                for id in self.cells.get(cell, ()):
+                    if id in checked:
+                        continue
+                    checked.add(id)
+                    distance = self.distance(id, x, y)
+                    if distance <= best_distance:
+                        best, best_distance = id, distance
+        return best
+
+def ring_cells(cx, cy, ring):
+    if ring == 0:
+        yield (cx, cy)
+        return
+    for dx in range(-ring, ring + 1):
+        yield (cx + dx, cy - ring)
+        yield (cx + dx, cy + ring)
+    for dy in range(-ring + 1, ring):
+        yield (cx - ring, cy + dy)
+        yield (cx + ring, cy + dy)
+
+def segment_distance(x, y, x0, y0, x1, y1):
+    dx, dy = x1 - x0, y1 - y0
+    length = dx*dx + dy*dy
+    if length == 0:
+        return math.hypot(x - x0, y - y0)
+    t = max(0, min(1, ((x - x0)*dx + (y - y0)*dy) / length))
+    return math.hypot(x - (x0 + t*dx), y - (y0 + t*dy))
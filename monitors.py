@@ -0,0 +1,127 @@
+import bisect
+import math
+
+from PyQt5.QtGui import QGuiApplication
+
+class Monitor():
+    def __init__(self, left, top, width, height, ppix, ppiy, name=""):
+        self.name = name
+        # right and bottom are exclusive
+        self.left, self.top = left, top
+        self.right, self.bottom = left + width, top + height
+        self.bounds = (self.left, self.top, self.right, self.bottom)
+        self.ppix = ppix
+        self.ppiy = ppiy
+
+    def contains(self, x, y):
+        return self.left <= x < self.right and self.top <= y < self.bottom
+
+    def loupe_bounds(self, x, y, size):
+        # Area of size[0] x size[1] pixels centered on (x, y), moved inside the monitor when it's near an edge
+        # [[left, top], [right, bottom]], right and bottom are exclusive
+        left = min(max(x - (size[0]-1)//2, self.left), self.right - size[0])
+        top = min(max(y - (size[1]-1)//2, self.top), self.bottom - size[1])
+        return [[left, top], [left + size[0], top + size[1]]]
+
+# Index of the monitor layout, so any global point can be resolved to its
+# monitor without walking all of them.
+# The edges of every monitor split the virtual desktop in cells, each cell
+# belongs to at most one monitor. A point is resolved by finding its cell
+# (bisect over a handful of edges), and the last monitor found is checked
+# first since the cursor rarely changes monitors.
+# The index is rebuilt whenever a screen is added, removed or changes.
+# A fixed list of monitors can be given instead (benchmarks, tests), then
+# the screens reported by Qt are ignored.
+class MonitorIndex():
+    def __init__(self, monitors=None, app=None):
+        self.fixed_monitors = monitors
+        if monitors is None:
+            if app is None:
+                app = QGuiApplication.instance()
+            self.app = app
+            self.connected_screens = set()
+            self.app.screenAdded.connect(self.rebuild)
+            self.app.screenRemoved.connect(self.rebuild)
+        self.rebuild()
+
+    def rebuild(self, *args):
+        if self.fixed_monitors is not None:
+            self.monitors = list(self.fixed_monitors)
+        else:
+            self.monitors = [monitor_from_screen(screen) for screen in self.app.screens()]
+            for screen in self.app.screens():
+                if screen not in self.connected_screens:
+                    screen.geometryChanged.connect(self.rebuild)
+                    screen.physicalDotsPerInchChanged.connect(self.rebuild)
+                    self.connected_screens.add(screen)
+
+        self.x_edges = sorted({edge for monitor in self.monitors for edge in (monitor.left, monitor.right)})
+        self.y_edges = sorted({edge for monitor in self.monitors for edge in (monitor.top, monitor.bottom)})
+        self.cells = {}
+        for monitor in self.monitors:
+            for ix in range(self.x_edges.index(monitor.left), self.x_edges.index(monitor.right)):
+                for iy in range(self.y_edges.index(monitor.top), self.y_edges.index(monitor.bottom)):
+                    self.cells[(ix, iy)] = monitor
+        self.last = self.monitors[0] if self.monitors else None
+
+    def screen_at(self, x, y):
+        if self.last is not None and self.last.contains(x, y):
+            return self.last
+        ix = bisect.bisect_right(self.x_edges, x) - 1
+        iy = bisect.bisect_right(self.y_edges, y) - 1
+        monitor = self.cells.get((ix, iy))
+        if monitor is None:
+            # Outside every monitor (gaps between monitors of different resolution), use the closest one
+            monitor = min(self.monitors, key=lambda m: distance_to_rect(x, y, m))
+        self.last = monitor
+        return monitor
+
+    def desktop_bounds(self):
+        # (left, top, right, bottom) of the whole virtual desktop
+        return (min(monitor.left for monitor in self.monitors), min(monitor.top for monitor in self.monitors),
+                max(monitor.right for monitor in self.monitors), max(monitor.bottom for monitor in self.monitors))
+
+    def ppi_along(self, x0, y0, x1, y1):
+        # Pixels per inch of the segment (x0, y0)-(x1, y1). When it crosses monitors each
+        # monitor counts as much as the length of the segment inside it
+        start = self.screen_at(x0, y0)
+        if start.contains(x1, y1):
+            return start.ppix, start.ppiy
+        length = math.hypot(x1-x0, y1-y0)
+        inches_x, inches_y = 0, 0
+        for monitor in self.monitors:
+            inside = clipped_length(x0, y0, x1, y1, monitor)
+            inches_x += inside / monitor.ppix
+            inches_y += inside / monitor.ppiy
+        if inches_x == 0 or inches_y == 0:
+            return start.ppix, start.ppiy
+        return length / inches_x, length / inches_y
+
+def monitor_from_screen(screen):
+    geometry = screen.geometry()
+    return Monitor(geometry.x(), geometry.y(), geometry.width(), geometry.height(),
+                   screen.physicalDotsPerInchX(), screen.physicalDotsPerInchY(), screen.name())
+
+def distance_to_rect(x, y, monitor):
+    dx = max(monitor.left - x, 0, x - (monitor.right - 1))
+    dy = max(monitor.top - y, 0, y - (monitor.bottom - 1))
+    return math.hypot(dx, dy)
+
+def clipped_length(x0, y0, x1, y1, monitor):
+    # Length of the part of the segment that is inside the monitor (Liang-Barsky clipping)
+    dx, dy = x1 - x0, y1 - y0
+    t0, t1 = 0, 1
+    for p, q in ((-dx, x0 - monitor.left), (dx, monitor.right - x0),
+                 (-dy, y0 - monitor.top), (dy, monitor.bottom - y0)):
+        if p == 0:
+            if q < 0:
+                return 0
+        else:
+            t = q / p
+            if p < 0:
+                t0 = max(t0, t)
+            else:
+                t1 = min(t1, t)
+    if t1 <= t0:
+        return 0
+    return (t1 - t0) * math.hypot(dx, dy)
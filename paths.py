@@ -0,0 +1,15 @@
+import os
+import sys
+
+# Files the program keeps (the session log, the calibrations, the trace) go in the
+# program's folder, not in the working directory, which is wherever a shortcut or
+# the exe was started from.
+def program_folder():
+    if getattr(sys, "frozen", False):
+        # pyinstaller, the folder of the exe and not where it was unpacked
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+def data_path(variable, name):
+    # The path in the environment variable, otherwise name in the program's folder
+    return os.environ.get(variable) or os.path.join(program_folder(), name)
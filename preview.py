@@ -1,157 +1,208 @@
 import math
 import time
 
-from PIL import ImageGrab, ImageStat
-
-from PyQt5.QtCore import QLineF, QSize, Qt
+from PyQt5 import sip
+from PyQt5.QtCore import QLineF, QPoint, QRect, QSize, Qt, pyqtSignal
 from PyQt5.QtWidgets import QWidget
-from PyQt5.QtGui import QPainter, QColor
+from PyQt5.QtGui import QImage, QPainter, QPixmap, QColor
+
+from capture import create_capture_source, mean_color, np
+from instrumentation import FrameProfiler
+from monitors import MonitorIndex
 
 class Preview(QWidget):
     M_SIZE = (21, 21) # Siempre tienen que ser impares para que el cursor esté en el centro
-    def __init__(self, h_res, v_res, *args, **kwargs):
+    frame_ready = pyqtSignal() # Emitted from the capture thread, delivered in the GUI thread
+    def __init__(self, h_res, v_res, *args, capture=None, monitors=None, origin=(0, 0), profiler=None, snapper=None, **kwargs):
         super(Preview, self).__init__(*args, **kwargs)
         
         self.h_res = h_res
         self.v_res = v_res
+        self.origin = origin # Global position of the ruler's top left corner
+        if capture is None:
+            capture = create_capture_source(on_frame=self.frame_ready.emit)
+        self.capture = capture
+        if monitors is None:
+            monitors = MonitorIndex()
+        self.monitors = monitors
+        if profiler is None:
+            profiler = FrameProfiler()
+        self.profiler = profiler
+        self.snapper = snapper
 
         self.xpadding = 150
         self.ypadding = 55
         self.grid_thickness = 1
-        self.pixel_size = 7
-        self.rect_width = self.M_SIZE[0]*self.pixel_size + self.grid_thickness*(self.M_SIZE[0]-1) + 1
-        self.rect_height = self.M_SIZE[1]*self.pixel_size + self.grid_thickness*(self.M_SIZE[1]-1) + 1
-
-        self.corner_positions = {
-            1: (self.h_res-self.xpadding-self.rect_width, self.ypadding),
-            2: (self.xpadding, self.ypadding),
-            3: (self.xpadding, self.v_res-self.ypadding-self.rect_height),
-            4: (self.h_res-self.xpadding-self.rect_width, self.v_res-self.ypadding-self.rect_height)
-        }
+        self.magnifiers = {} # (size, pixel_size) -> MagnifierGeometry
+        self.set_magnifier(self.M_SIZE, 7)
+
+    def set_magnifier(self, size, pixel_size):
+        # Sizes have to be odd so the cursor is in the center
+        size = (size[0] | 1, size[1] | 1)
+        key = (size, pixel_size)
+        if key not in self.magnifiers:
+            self.magnifiers[key] = MagnifierGeometry(size, pixel_size, self.grid_thickness)
+        self.magnifier = self.magnifiers[key]
+
+        self.M_SIZE = self.magnifier.size
+        self.pixel_size = self.magnifier.pixel_size
+        self.rect_width = self.magnifier.rect_width
+        self.rect_height = self.magnifier.rect_height
+        self.grid_overlay = self.magnifier.grid_overlay
 
         self.setFixedSize(QSize(self.rect_width+1, self.rect_height+1))
         self.update_pos()
 
-    
+    def snap_limit(self):
+        # The capture is only clean inside the hole around the cursor, beyond it there is the dark background
+        return (min(self.M_SIZE) - 1)//2 - 1
+
     def update_pos(self):
         self.x, self.y = self.cursor().pos().x(), self.cursor().pos().y()
-        self.true_corners = get_corners_coords(self.x, self.y, self.h_res, self.v_res, self.M_SIZE)
-        self.screen_corners = get_corners_coords(self.x % self.h_res, self.y % self.v_res, self.h_res, self.v_res, self.M_SIZE)
-
-    def paintEvent(self, event):
-        if self.x >= self.h_res/2:
-            if self.y >= self.v_res/2:
-                cuadrant = 4
-            else:
-                cuadrant = 1
+        self.monitor = self.monitors.screen_at(self.x, self.y)
+        self.monitor_bounds = self.monitor.bounds
+        self.true_corners = self.monitor.loupe_bounds(self.x, self.y, self.M_SIZE)
+        # Same corners, relative to the ruler window
+        self.screen_corners = [[corner[0] - self.origin[0], corner[1] - self.origin[1]] for corner in self.true_corners]
+
+    def panel_corner(self, size):
+        # Top left corner of the panels (the magnifier and what is under it), in the corner opposite to the cursor
+        x, y = self.x - self.origin[0], self.y - self.origin[1]
+        if x >= self.h_res/2:
+            left = self.xpadding
         else:
-            if self.y >= self.v_res/2:
-                cuadrant = 3
-            else:
-                cuadrant = 2
-        
-        opposite_cuadrants = {1: 3, 3: 1, 2: 4, 4: 2}
-        cuadrant = opposite_cuadrants[cuadrant]
-        corner = self.corner_positions[cuadrant]
-
-        self.move(corner[0], corner[1])
+            left = self.h_res - self.xpadding - size.width()
+        if y >= self.v_res/2:
+            top = self.ypadding
+        else:
+            top = self.v_res - self.ypadding - size.height()
+        return QPoint(left, top)
 
+    def paintEvent(self, event):
+        # Paint zoomed pixels
+        # The whole monitor is grabbed at most once per frame tick, the patch is a slice of it
+        with self.profiler.phase("capture"):
+            self.capture.update(self.monitor_bounds)
+            patch = self.capture.region(self.true_corners[0][0],
+                                        self.true_corners[0][1],
+                                        self.true_corners[1][0],
+                                        self.true_corners[1][1])
+        with self.profiler.phase("magnifier"):
+            self.paint_magnifier(patch)
+
+        latency = self.capture.mark_displayed()
+        if latency is not None:
+            # A new frame, recorded once
+            self.profiler.record_grab(self.capture.timestamp, self.capture.grab_time)
+            self.profiler.record_latency(latency)
+
+    def paint_magnifier(self, patch):
         painter = QPainter()
         painter.begin(self)
+        if patch is None or patch_size(patch) != self.M_SIZE:
+            # The capture of this monitor isn't ready yet
+            painter.drawPixmap(0, 0, self.grid_overlay)
+            self.paint_error(painter)
+            painter.end()
+            return
+
+        average = mean_color(patch)
+        # self.patch_data has to outlive the QImage, which doesn't own the pixels
+        image, self.patch_data = to_qimage(patch)
+
+        # Each pixel becomes a cell of pixel_size + grid_thickness, the grid is painted on top afterwards.
+        # No SmoothPixmapTransform, so the scaling is nearest neighbour
+        cell = self.pixel_size + self.grid_thickness
+        painter.drawImage(QRect(1, 1, image.width()*cell, image.height()*cell), image)
+
+        # Paint the cursor's row and column with the inverse of the average color
+        row = self.y - self.true_corners[0][1]
+        col = self.x - self.true_corners[0][0]
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor(255 - average[0], 255 - average[1], 255 - average[2], 120))
+        if 0 <= row < self.M_SIZE[1]:
+            painter.drawRect(1, 1 + row*cell, self.M_SIZE[0]*cell, cell)
+            if 0 <= col < self.M_SIZE[0]:
+                painter.drawRect(1 + col*cell, 1, cell, row*cell)
+                painter.drawRect(1 + col*cell, 1 + (row+1)*cell, cell, (self.M_SIZE[1]-row-1)*cell)
+        elif 0 <= col < self.M_SIZE[0]:
+            painter.drawRect(1 + col*cell, 1, cell, self.M_SIZE[1]*cell)
+
+        painter.drawPixmap(0, 0, self.grid_overlay)
+
+        if self.snapper is not None and self.snapper.enabled:
+            # Outline the pixel a click would snap to
+            snap_x, snap_y = self.snapper.snap(self.capture, self.x, self.y, self.snap_limit())
+            painter.setPen(QColor(255, 0, 255))
+            painter.setBrush(Qt.NoBrush)
+            painter.drawRect((snap_x - self.true_corners[0][0])*cell, (snap_y - self.true_corners[0][1])*cell, cell, cell)
+        # The zoomed pixels may be an old frame
+        self.paint_error(painter)
+        painter.end()
+
+    def paint_error(self, painter):
+        if self.capture.error is None:
+            return
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor(0, 0, 0, 200))
+        painter.drawRect(1, 1, self.rect_width - 1, self.rect_height - 1)
+        painter.setPen(QColor(255, 80, 80))
+        painter.drawText(QRect(5, 5, self.rect_width - 10, self.rect_height - 10),
+                         Qt.AlignCenter | Qt.TextWordWrap, "capture failed\n" + self.capture.error)
+
+# Everything that only depends on the magnifier's size and zoom, computed once per configuration
+class MagnifierGeometry():
+    def __init__(self, size, pixel_size, grid_thickness):
+        self.size = size
+        self.pixel_size = pixel_size
+        self.grid_thickness = grid_thickness
+        self.rect_width = size[0]*pixel_size + grid_thickness*(size[0]-1) + 1
+        self.rect_height = size[1]*pixel_size + grid_thickness*(size[1]-1) + 1
+
+        self.v_lines = []
+        for i in range(size[0]-1):
+            x = 1+ (i+1) * pixel_size + grid_thickness * i
+            line = QLineF(x, 1, x, self.rect_height - 1)
+            self.v_lines.append(line)
+
+        self.h_lines = []
+        for i in range(size[1]-1):
+            y = 1 + (i+1) * pixel_size + grid_thickness * i
+            line = QLineF(1, y, self.rect_width - 1, y)
+            self.h_lines.append(line)
+
+        self.grid_overlay = self.generate_grid_overlay()
+
+    def generate_grid_overlay(self):
+        # Border and grid are drawn once and blitted on top of the zoomed pixels
+        overlay = QPixmap(self.rect_width+1, self.rect_height+1)
+        overlay.fill(Qt.transparent)
+        painter = QPainter(overlay)
         painter.setPen(QColor(75, 75, 75))
 
         # Paint border
         painter.drawRect(0, 0, self.rect_width, self.rect_height)
 
         # Paint the grid
-        v_lines = []
-        for i in range(self.M_SIZE[0]-1):
-            x = 1+ (i+1) * self.pixel_size + self.grid_thickness * i
-            line = QLineF(x, 1, x, self.rect_height - 1)
-            v_lines.append(line)
-
-        h_lines = []
-        for i in range(self.M_SIZE[0]-1):
-            y = 1 + (i+1) * self.pixel_size + self.grid_thickness * i
-            line = QLineF(1, y, self.rect_width - 1, y)
-            h_lines.append(line)
-
-        painter.drawLines(v_lines)
-        painter.drawLines(h_lines)
-
-        # Paint zoomed pixels
-        img = ImageGrab.grab(bbox=(self.true_corners[0][0],
-                                      self.true_corners[0][1],
-                                      self.true_corners[1][0],
-                                      self.true_corners[1][1]),
-                            all_screens=True)
-        pixels = img.load()
-        average = ImageStat.Stat(img).mean
-        for row in range(self.M_SIZE[1]):
-            for col in range(self.M_SIZE[0]):
-                color = QColor(*pixels[col, row])
-                
-                painter.setPen(Qt.NoPen)
-                painter.setBrush(color)
-                painter.drawRect(1 + col * self.pixel_size + col * self.grid_thickness,
-                                 1 + row * self.pixel_size + row * self.grid_thickness,
-                                 self.pixel_size, self.pixel_size)
-
-                if (row == self.y-self.true_corners[0][1]
-                    or col == self.x-self.true_corners[0][0]):
-                        pixel = ((255 - average[0]), (255 - average[1]), (255 - average[2]), 120)
-                        color = QColor(*pixel)
-                painter.setPen(Qt.NoPen)
-                painter.setBrush(color)
-                painter.drawRect(1 + col * self.pixel_size + col * self.grid_thickness,
-                                 1 + row * self.pixel_size + row * self.grid_thickness,
-                                 self.pixel_size, self.pixel_size)
-
-def get_corners_coords(x, y, h_res, v_res, size):
-    monitorx, monitory = 0, 0
-    low_h, low_v, high_h, high_v = 0, 0, h_res, v_res
-    temp_x = x
-    while temp_x > h_res:
-        temp_x -= h_res
-        monitorx += 1
-    high_h += monitorx * h_res
-    low_h += monitorx * h_res
-    temp_y = y
-    while temp_y > v_res:
-        temp_y -= v_res
-        monitory += 1
-    high_v += monitory * v_res
-    low_v += monitory * v_res
-
-    corners = [[0, 0], [h_res, v_res]]
-    x_increment = (size[0] - 1)/2
-    y_increment = (size[1] - 1)/2
-    h_res -= 1
-    v_res -= 1
-
-    if x - x_increment > low_h:
-        corners[0][0] = x - x_increment
-        if x + x_increment < high_h:
-            corners[1][0] = x + x_increment
-        else:
-            corners[1][0] = high_h
-            corners[0][0] = high_h - size[0] + 1
-    else:
-        corners[0][0] = low_h
-        corners[1][0] = low_h + size[0] - 1
-
-    if y - y_increment > low_v:
-        corners[0][1] = y - y_increment
-        if y + y_increment < high_v:
-            corners[1][1] = y + y_increment
-        else:
-            corners[1][1] = high_v
-            corners[0][1] = high_v - size[1] + 1
-    else:
-        corners[0][1] = low_v
-        corners[1][1] = low_v + size[1] - 1
-    
-    corners[1][0] += 1
-    corners[1][1] += 1
-    
-    return corners
\ No newline at end of file
+        painter.drawLines(self.v_lines)
+        painter.drawLines(self.h_lines)
+        painter.end()
+        return overlay
+
+def patch_size(patch):
+    if np is None:
+        return patch.size
+    return (patch.shape[1], patch.shape[0])
+
+def to_qimage(patch):
+    # Returns the QImage and the object holding its pixels
+    if np is None:
+        data = patch.tobytes()
+        return QImage(data, patch.width, patch.height, patch.width*3, QImage.Format_RGB888), data
+    if patch.strides[1:] != (3, 1):
+        # e.g. BGRA buffers seen as RGB, rows have to be packed first
+        patch = np.ascontiguousarray(patch)
+    height, width = patch.shape[:2]
+    # Points directly into the capture buffer, no copy
+    image = QImage(sip.voidptr(patch.ctypes.data), width, height, patch.strides[0], QImage.Format_RGB888)
+    return image, patch
@@ -0,0 +1,175 @@
+# Records the input of the ruler to a file and replays it headless to profile it
+# SCREENRULER_RECORD=input.rec python main.py
+# python replay.py input.rec > replay.json
+# python replay.py input.rec --realtime --image screenshot.png --output replay.json
+#
+# The file starts with a header (the ruler's size, position, magnifier and fps) followed
+# by one fixed size record per event: time since the recording started, event type,
+# mouse button, keyboard modifiers, key and global cursor position.
+# The replay creates the ruler on the offscreen platform with a fake capture (noise,
+# or --image), moves the cursor where it was and calls the ruler's event handlers
+# with the same events. Without --realtime the events are replayed as fast as
+# possible: the recorded times only decide when the frames happen, so the same
+# file always gives the same frames. Each event is timed, including the frame it
+# triggers, and the report has percentiles per event type and the slowest events.
+import argparse
+import os
+import struct
+import sys
+import time
+
+from PyQt5.QtCore import QEvent, QObject, QPoint, Qt
+from PyQt5.QtGui import QCursor, QKeyEvent, QMouseEvent
+from PyQt5.QtWidgets import QApplication
+
+MAGIC = b"SRREC1\0\0"
+HEADER = struct.Struct("<8siiiiiii") # magic, width, height, origin x, origin y, magnifier size, zoom, fps
+RECORD = struct.Struct("<dBBHiii") # time, type, button, modifiers, key, x, y
+
+MOVE, PRESS, RELEASE, DOUBLE_CLICK, KEY = 1, 2, 3, 4, 5
+EVENT_TYPES = {QEvent.MouseMove: MOVE, QEvent.MouseButtonPress: PRESS, QEvent.MouseButtonRelease: RELEASE,
+               QEvent.MouseButtonDblClick: DOUBLE_CLICK, QEvent.KeyPress: KEY}
+EVENT_NAMES = {MOVE: "move", PRESS: "press", RELEASE: "release", DOUBLE_CLICK: "double_click", KEY: "key"}
+BUTTONS = {Qt.NoButton: 0, Qt.LeftButton: 1, Qt.RightButton: 2, Qt.MiddleButton: 3}
+# Qt's modifiers are bits 25 to 29, they are stored shifted down to fit in 16 bits
+MODIFIER_SHIFT = 25
+
+class Recorder(QObject):
+    def __init__(self, ruler, path, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, ruler.h_res, ruler.v_res, ruler.origin[0], ruler.origin[1],
+                                    ruler.preview.M_SIZE[0], ruler.preview.pixel_size, int(ruler.scheduler.fps)))
+        self.start = time.perf_counter()
+        self.count = 0
+        ruler.installEventFilter(self)
+        QApplication.instance().aboutToQuit.connect(self.close)
+
+    def eventFilter(self, watched, event):
+        event_type = EVENT_TYPES.get(event.type())
+        if event_type is not None and self.file is not None:
+            pos = QCursor.pos()
+            if event_type == KEY:
+                button, key = 0, event.key()
+            else:
+                button, key = BUTTONS.get(event.button(), 0), 0
+            modifiers = int(event.modifiers()) >> MODIFIER_SHIFT
+            self.file.write(RECORD.pack(time.perf_counter() - self.start, event_type, button, modifiers, key, pos.x(), pos.y()))
+            self.count += 1
+            if self.count % 256 == 0:
+                self.file.flush()
+        return False
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def read_recording(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, *header = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(path + " is not an input recording")
+    body = data[HEADER.size:]
+    body = body[:len(body) - len(body) % RECORD.size] # The last record may be incomplete
+    return header, list(RECORD.iter_unpack(body))
+
+def to_event(record, local):
+    t, event_type, button, modifiers, key, x, y = record
+    modifiers = Qt.KeyboardModifiers(modifiers << MODIFIER_SHIFT)
+    if event_type == KEY:
+        return QKeyEvent(QEvent.KeyPress, key, modifiers)
+    qt_button = {v: k for k, v in BUTTONS.items()}[button]
+    qt_type = {v: k for k, v in EVENT_TYPES.items()}[event_type]
+    buttons = Qt.NoButton if event_type in (MOVE, RELEASE) else qt_button
+    return QMouseEvent(qt_type, local, qt_button, buttons, modifiers)
+
+def deliver(ruler, event_type, event):
+    if event_type == MOVE:
+        ruler.mouseMoveEvent(event)
+    elif event_type == PRESS:
+        ruler.mousePressEvent(event)
+    elif event_type == RELEASE:
+        ruler.mouseReleaseEvent(event)
+    elif event_type == DOUBLE_CLICK:
+        ruler.mouseDoubleClickEvent(event)
+    else:
+        ruler.keyPressEvent(event)
+
+def replay(path, realtime=False, image=None, slowest=20):
+    from benchmark import create_ruler, percentiles
+    from capture import to_buffer
+
+    (width, height, origin_x, origin_y, magnifier_size, zoom, fps), records = read_recording(path)
+    app = QApplication.instance() or QApplication(sys.argv)
+    desktop = None
+    if image is not None:
+        from PIL import Image
+        desktop = to_buffer(Image.open(image))[:height, :width]
+    ruler = create_ruler([(0, 0, width, height)], desktop=desktop)
+    ruler.set_magnifier((magnifier_size, magnifier_size), zoom)
+    ruler.scheduler.set_fps(fps)
+    ruler.profiler.enabled = True
+    scheduler = ruler.scheduler
+
+    timings = []
+    next_frame = 0
+    start = time.perf_counter()
+    for index, record in enumerate(records):
+        t, event_type, button, modifiers, key, x, y = record
+        if realtime:
+            # Let the event loop run (timers, frames) until it's time for this event
+            while time.perf_counter() - start < t:
+                app.processEvents()
+        # The offscreen screen starts at (0, 0)
+        QCursor.setPos(x - origin_x, y - origin_y)
+        event = to_event(record, QPoint(x - origin_x, y - origin_y))
+
+        event_start = time.perf_counter()
+        deliver(ruler, event_type, event)
+        if realtime:
+            app.processEvents()
+        elif t >= next_frame and (scheduler.pending or scheduler.timer.isActive()):
+            # A frame happens on the first event after the previous frame's interval went by
+            scheduler.timer.stop()
+            scheduler.flush()
+            app.processEvents()
+            next_frame = t + scheduler.frame_interval
+        timings.append((time.perf_counter() - event_start, index, t, event_type, key))
+
+    if not realtime and (scheduler.pending or scheduler.timer.isActive()):
+        scheduler.timer.stop()
+        scheduler.flush()
+        app.processEvents()
+
+    by_type = {}
+    for duration, index, t, event_type, key in timings:
+        by_type.setdefault(EVENT_NAMES[event_type], []).append(duration)
+    result = {
+        "recording": path, "events": len(records), "realtime": realtime,
+        "recorded_duration_s": records[-1][0] if records else 0,
+        "replay_duration_s": time.perf_counter() - start,
+        "all": percentiles([timing[0] for timing in timings]) if timings else None,
+        "by_type": {name: percentiles(samples) for name, samples in by_type.items()},
+        "slowest": [{"index": index, "time_s": t, "type": EVENT_NAMES[event_type], "key": key, "ms": duration * 1000}
+                    for duration, index, t, event_type, key in sorted(timings, reverse=True)[:slowest]],
+        "phases": {name: dict(zip(("p50_ms", "p99_ms"), [None if p is None else p * 1000 for p in ruler.profiler.percentiles(name)]))
+                   for name in ruler.profiler.history},
+        "scheduler": scheduler.stats()
+    }
+    ruler.close()
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded Screen Ruler input session headless")
+    parser.add_argument("recording")
+    parser.add_argument("--realtime", action="store_true", help="wait between events like when they were recorded")
+    parser.add_argument("--image", help="screenshot shown by the fake capture instead of noise")
+    parser.add_argument("--slowest", type=int, default=20, help="how many of the slowest events to list")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from benchmark import write_results
+    write_results(replay(args.recording, args.realtime, args.image, args.slowest), args.output)
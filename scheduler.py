@@ -0,0 +1,99 @@
+import time
+
+from PyQt5.QtCore import QObject, QTimer
+from PyQt5.QtGui import QRegion
+
+# Merges every repaint request that arrives between two display refreshes
+# into a single update() per widget.
+# Mouse events can arrive at 1000 Hz, but there is no point in painting more
+# often than the monitor refreshes. When nothing requests a repaint the timer
+# is left stopped, so an idle ruler doesn't paint at all.
+class RenderScheduler(QObject):
+    def __init__(self, fps=60, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pending = {} # widget -> QRegion, or None for the whole widget
+        self.frame_callbacks = []
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.flush)
+        self.set_fps(fps)
+        self.last_frame = 0
+        self.deadline = 0
+        self.flushing = False
+        self.next_frame = False # A frame was asked for while flushing, it's the next one
+
+        self.requests = 0
+        self.frames = 0
+        self.coalesced = 0 # requests merged into an already pending frame
+        self.dropped = 0 # refreshes missed because a frame was late
+
+    def set_fps(self, fps):
+        if fps <= 0:
+            fps = 60
+        self.fps = fps
+        self.frame_interval = 1/fps
+
+    def add_frame_callback(self, callback):
+        # Called once at the start of every frame, before the widgets are updated
+        self.frame_callbacks.append(callback)
+
+    def request(self, widget, region=None):
+        self.requests += 1
+        if widget in self.pending:
+            self.coalesced += 1
+            old_region = self.pending[widget]
+            if old_region is None or region is None:
+                self.pending[widget] = None
+            else:
+                self.pending[widget] = old_region.united(QRegion(region))
+        else:
+            self.pending[widget] = None if region is None else QRegion(region)
+        self.start()
+
+    def request_frame(self):
+        # The frame callbacks run on the next frame even if nothing has to be repainted.
+        # Asked from a frame callback, it's the frame after this one
+        if self.flushing:
+            self.next_frame = True
+        else:
+            self.start()
+
+    def start(self):
+        if not self.flushing and not self.timer.isActive():
+            now = time.perf_counter()
+            self.deadline = max(now, self.last_frame + self.frame_interval)
+            self.timer.start(int((self.deadline - now) * 1000))
+
+    def flush(self):
+        now = time.perf_counter()
+        late = now - self.deadline
+        if late > self.frame_interval:
+            self.dropped += int(late / self.frame_interval)
+        self.last_frame = now
+        self.frames += 1
+
+        # Requests made by the callbacks go into this same frame
+        self.flushing = True
+        for callback in self.frame_callbacks:
+            callback()
+        self.flushing = False
+        if self.next_frame:
+            self.next_frame = False
+            self.start()
+
+        pending = self.pending
+        self.pending = {}
+        for widget, region in pending.items():
+            if region is None:
+                widget.update()
+            else:
+                widget.update(region)
+
+    def stats(self):
+        return {
+            "fps": self.fps,
+            "requests": self.requests,
+            "frames": self.frames,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped
+        }
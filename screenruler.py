@@ -3,31 +3,71 @@ import math
 import time
 
 from PyQt5.QtWidgets import QApplication, QWidget
-from PyQt5.QtCore import QRect, QSize, Qt, QPoint
-from PyQt5.QtGui import QBitmap, QCursor, QIcon, QPainter, QColor, QPixmap, QStaticText
+from PyQt5.QtCore import QEvent, QRect, QSize, Qt, QPoint, QPointF, QTimer
+from PyQt5.QtGui import QBitmap, QCursor, QFontDatabase, QFontMetrics, QIcon, QMouseEvent, QPainter, QColor, QPixmap, QRegion
 
+from colorstats import ColorInspector
+from dimensions import labels, labels_many, measure, measure_many, np
+from edges import EdgeSnapper
+from guides import GridOverlay
+from instrumentation import FrameProfiler
+from labelcache import LabelCache
+from measurements import MeasurementStore
+from monitors import MonitorIndex
 from preview import Preview
+from scheduler import RenderScheduler
+from session import REMOVE
+from smartgridlayout import Panel, SmartGridItem, SmartGridLayout
+from snapshots import FreezeFrame
 
 # Subclass QMainWindow to customise your application's main window
 class RulerWindow(QWidget):
-    def __init__(self, *args, **kwargs):
+    SNAPSHOT_DELAY = 100 # ms the window manager is given to take the overlay off the screen before a snapshot
+    SNAPSHOT_TIMEOUT = 5000 # ms after which the overlay comes back without the snapshot
+    LAYER_TILE = 512 # Side of the squares the measurement layer is drawn in
+    LAYER_BUDGET = 0.008 # s a paint can spend drawing the measurement layer, the rest waits for the next frames
+
+    def __init__(self, *args, capture=None, fps=None, monitors=None, session=None, **kwargs):
         super(RulerWindow, self).__init__(*args, **kwargs)
+        self.capture = capture
+        self.fps = fps # None = use the monitor's refresh rate
+        self.scheduler = RenderScheduler(parent=self)
+        self.scheduler.add_frame_callback(self.new_frame)
+        if monitors is None:
+            monitors = MonitorIndex()
+        self.monitors = monitors
+        self.profiler = FrameProfiler()
+        self.snapper = EdgeSnapper()
+        self.inspector = ColorInspector()
+        self.grid = GridOverlay()
+        self.freeze = FreezeFrame()
+        self.label_cache = LabelCache()
+        self.hud_font = QFontDatabase.systemFont(QFontDatabase.FixedFont)
+        QApplication.instance().aboutToQuit.connect(self.profiler.dump)
         self.setWindowTitle("Screen Ruler")
         self.setWindowIcon(QIcon("ruler.ico"))
-        self.initial_dots = []
-        self.final_dots = []
+        self.measurements = MeasurementStore()
+        self.session = session # SessionLog where every change is saved, None = nothing is saved
+        self.pending_start = None # First point of the measurement being made
+        self.moving_rect = QRect() # Area covered by the in-progress triangle in the last frame
+        self.pending_selection = None # (x, y, dragged) where a color selection starts once the snapshot is taken
+        self.preview = None # Created by set_sizes
 
         self.setWindowFlags(Qt.WindowStaysOnTopHint | Qt.FramelessWindowHint | Qt.WindowSystemMenuHint)
         self.setAttribute(Qt.WA_TranslucentBackground)
         self.ignored = False
         self.setMouseTracking(True)
-        self.custom_cursor = self.generate_custom_cursor()
+        self.cursors = {} # magnifier size -> QCursor
+        self.custom_cursor = self.get_custom_cursor(Preview.M_SIZE)
         #self.setCursor(Qt.BlankCursor)
         self.setCursor(self.custom_cursor)
     
     def set_sizes(self, h_res, v_res, size):
+        screen = self.screen()
+        self.origin = (screen.geometry().x(), screen.geometry().y())
+        self.auto_ppi = h_res == "auto"
         if h_res == "auto":
-            screen = self.screen()
+            # Each measurement uses the ppi of the monitors it is in, these are only the defaults
             self.ppix = screen.physicalDotsPerInchX()
             self.ppiy = screen.physicalDotsPerInchY()
             h_res = screen.geometry().width()
@@ -35,141 +75,543 @@ class RulerWindow(QWidget):
             #if self.ppix != self.ppiy:
             #    print("WARNING! due to the properties of your screen angles are slightly distorted and length of diagonals are approximations")
         else:
-            diagonal_res = math.sqrt(int(h_res)**2+int(v_res)**2)
+            h_res, v_res = int(h_res), int(v_res)
+            diagonal_res = math.sqrt(h_res**2+v_res**2)
             self.ppix = diagonal_res/float(size) # Pixels per inch
             self.ppiy = self.ppix
 
-        self.preview = Preview(h_res, v_res, self)
+        self.preview = Preview(h_res, v_res, self, capture=self.capture, monitors=self.monitors, origin=self.origin,
+                               profiler=self.profiler, snapper=self.snapper)
+        # Frames captured in the background are shown as soon as they arrive
+        self.preview.frame_ready.connect(lambda: self.scheduler.request(self.preview))
+        self.preview.frame_ready.connect(self.freeze_frame)
+        self.snapshot_pending = False
+        self.snapshot_timer = QTimer(self)
+        self.snapshot_timer.setSingleShot(True)
+        self.snapshot_timer.timeout.connect(self.snapshot_timed_out)
         self.preview.show()
+        self.live_capture = self.preview.capture # While frozen the preview reads a snapshot instead
         self.h_res, self.v_res = h_res, v_res
+        # The magnifier, with the color readout and the HUD under it, placed together in a corner
+        hud_size = self.profiler.hud_rect(self.hud_font, 1).size()
+        self.hud_panel = Panel(hud_size.width(), hud_size.height(), not self.profiler.enabled)
+        self.color_panel = Panel(*self.inspector.panel_size(self.hud_font), not self.inspector.enabled)
+        self.freeze_panel = Panel(*self.freeze.panel_size(self.hud_font), not self.freeze.frozen())
+        self.magnifier_item = SmartGridItem(self.preview)
+        self.freeze_item = SmartGridItem(self.freeze_panel, 0, 10)
+        self.color_item = SmartGridItem(self.color_panel, 0, 10)
+        self.hud_item = SmartGridItem(self.hud_panel, 0, 10)
+        self.panels = SmartGridLayout(None, [[self.magnifier_item], [self.freeze_item], [self.color_item], [self.hud_item]])
+        self.layout_panels()
+        if self.fps is None:
+            self.scheduler.set_fps(self.screen().refreshRate())
+        else:
+            self.scheduler.set_fps(self.fps)
+        self.cursor_moved = False
+        self.grab_pending = False # The hole moved in the last frame, the magnifier grabs in this one
+        # Biggest label that can be drawn, used to know which area a triangle covers
+        metrics = QFontMetrics(self.font())
+        self.label_width = metrics.horizontalAdvance("99999.99px | 9999.99cm | 9999.99inch")
+        self.label_ascent = metrics.ascent()
+        self.label_height = metrics.height()
+        self.measurement_layer = None
+        self.layer_stale = QRegion() # Area of the layer that has to be drawn again
+        self.layer_job = None # (rect, ids, next index) of a tile that ran out of time while being drawn
+        self.invalidate_measurement_layer()
+        if self.session is not None:
+            self.load_session()
+
+    def moveEvent(self, event):
+        self.follow_screen()
+
+    def resizeEvent(self, event):
+        self.follow_screen()
+
+    def follow_screen(self):
+        # The ruler can be moved to another monitor (win+shift+arrow), everything that converts
+        # between global and window coordinates has to use where the window is now
+        if self.preview is None:
+            return
+        pos = self.mapToGlobal(QPoint(0, 0))
+        origin = (pos.x(), pos.y())
+        size = (self.width(), self.height())
+        if origin == self.origin and size == (self.h_res, self.v_res):
+            return
+        if origin != self.origin:
+            self.origin = self.preview.origin = origin
+            if self.auto_ppi:
+                screen = self.screen()
+                self.ppix = screen.physicalDotsPerInchX()
+                self.ppiy = screen.physicalDotsPerInchY()
+                # The labels use the ppi of the monitors the measurements are in now
+                self.measurements.clear_labels()
+            if self.fps is None:
+                self.scheduler.set_fps(self.screen().refreshRate())
+        if size != (self.h_res, self.v_res):
+            self.h_res, self.v_res = size
+            self.preview.h_res, self.preview.v_res = size
+            self.measurement_layer = None
+            self.layer_stale = QRegion()
+            self.layer_job = None
+        self.invalidate_measurement_layer()
+        self.preview.update_pos()
+        self.layout_panels()
+        self.scheduler.request(self)
+        self.scheduler.request(self.preview)
+
+    def load_session(self):
+        loaded = self.session.load()
+        if loaded is None:
+            return
+        ids, x0, y0, x1, y1, alive = loaded
+        # Undo and redo use the ids of the log, extend has to give the measurements those same ids
+        first = len(self.measurements.alive)
+        if len(ids) and (ids[0] != first or ids[-1] != first + len(ids) - 1):
+            print("session not loaded: its ids don't match the measurements", file=sys.stderr)
+            self.session.undo_stack, self.session.redo_stack = [], []
+            return
+        if np is not None:
+            bounds = self.measurement_bounds(x0, y0, x1, y1)
+            columns = [column.tolist() for column in (x0, y0, x1, y1) + bounds]
+        else:
+            rects = [self.measurement_rect(QPoint(*start), QPoint(*end)) for start, end in zip(zip(x0, y0), zip(x1, y1))]
+            bounds = [[r.left() for r in rects], [r.top() for r in rects], [r.right()+1 for r in rects], [r.bottom()+1 for r in rects]]
+            columns = [x0, y0, x1, y1] + bounds
+        self.measurements.extend(*columns, alive)
+        self.invalidate_measurement_layer()
+
+    def measurement_bounds(self, x0, y0, x1, y1):
+        # measurement_rect of many measurements at once (numpy arrays) as left, top, right, bottom (exclusive)
+        halfx = np.trunc((x1 - x0)/2 + x0).astype(np.int64)
+        halfy = (y1 - y0)/2 + y0
+        label_x = (halfx, x1, halfx)
+        label_y = (y0.astype(np.int64), np.trunc(halfy).astype(np.int64), np.trunc(halfy - 12).astype(np.int64))
+        left = np.minimum(np.minimum(x0, x1) - 11, np.minimum(halfx, x1))
+        top = np.minimum(y0, y1) - 11
+        right = np.maximum(x0, x1) + 12
+        bottom = np.maximum(y0, y1) + 12
+        for x, y in zip(label_x, label_y):
+            top = np.minimum(top, y - self.label_ascent)
+            right = np.maximum(right, x + self.label_width)
+            bottom = np.maximum(bottom, y - self.label_ascent + self.label_height)
+        return left, top, right, bottom
+
+    def new_frame(self):
+        self.profiler.new_frame()
+        if self.grab_pending:
+            # The moved hole was flushed to the screen in the last frame, so a grab made now
+            # doesn't have the dark background where the magnifier looks
+            self.grab_pending = False
+            self.preview.capture.invalidate()
+            self.scheduler.request(self.preview)
+        # Mouse moves are only processed once per frame, no matter how many arrived
+        if self.cursor_moved:
+            self.cursor_moved = False
+            old_hole = self.hole_rect()
+            self.preview.update_pos()
+            self.grab_pending = True
+            self.scheduler.request_frame()
+            # Only the parts of the overlay that changed are repainted
+            dirty = QRegion(old_hole).united(self.hole_rect())
+            if self.pending_start is not None:
+                moving_rect = self.measurement_rect(self.pending_start, self.snapped(self.local_cursor_pos()))
+                dirty = dirty.united(self.moving_rect).united(moving_rect)
+                self.moving_rect = moving_rect
+            if self.inspector.dragging:
+                dirty = dirty.united(self.selection_rect())
+                pos = self.cursor().pos()
+                self.inspector.update_selection(pos.x(), pos.y())
+                dirty = dirty.united(self.selection_rect())
+            self.scheduler.request(self, dirty)
+        # After the cursor moved, the panels may go to another corner
+        dirty = self.layout_panels()
+        if self.profiler.enabled:
+            dirty = dirty.united(self.hud_panel.geometry())
+        if self.inspector.enabled:
+            dirty = dirty.united(self.color_panel.geometry())
+        if not dirty.isEmpty():
+            self.scheduler.request(self, dirty)
+
+    def layout_panels(self):
+        # Returns the area of the overlay the panels moved from and to
+        for panel, item, enabled in ((self.hud_panel, self.hud_item, self.profiler.enabled),
+                                     (self.color_panel, self.color_item, self.inspector.enabled),
+                                     (self.freeze_panel, self.freeze_item, self.freeze.frozen())):
+            if panel.hidden == enabled:
+                panel.hidden = not enabled
+                item.invalidate()
+        size = self.panels.sizeHint()
+        self.panels.setGeometry(QRect(self.preview.panel_corner(size), size))
+        return self.panels.take_changed()
+
+    def local_cursor_pos(self):
+        # Cursor position relative to the ruler window
+        pos = self.cursor().pos()
+        return QPoint(pos.x() - self.origin[0], pos.y() - self.origin[1])
+
+    def snapped(self, pos):
+        # pos (relative to the ruler window) moved to the closest edge when snapping is on
+        if not self.snapper.enabled:
+            return pos
+        x, y = self.snapper.snap(self.preview.capture, pos.x() + self.origin[0], pos.y() + self.origin[1],
+                                 self.preview.snap_limit())
+        return QPoint(x - self.origin[0], y - self.origin[1])
+
+    def ppi_of(self, start, end_point):
+        if not self.auto_ppi:
+            return self.ppix, self.ppiy
+        return self.monitors.ppi_along(start.x() + self.origin[0], start.y() + self.origin[1],
+                                       end_point.x() + self.origin[0], end_point.y() + self.origin[1])
+
+    def color_panel_rect(self):
+        return self.color_panel.geometry()
+
+    def selection_rect(self):
+        # Area covered by the outline of the color selection
+        if self.inspector.selection is None:
+            return QRect()
+        left, top, right, bottom = self.inspector.selection_bounds()
+        return QRect(left - self.origin[0] - 1, top - self.origin[1] - 1, right - left + 2, bottom - top + 2)
+
+    def clean_region(self, region):
+        # region without the hole. When frozen or when the magnifier is off nothing is grabbed there
+        if self.ignored or self.freeze.frozen():
+            return region
+        return region.subtracted(QRegion(self.hole_rect()))
+
+    def hole_rect(self):
+        # Area around the cursor that is not covered by the dark background (including its border)
+        corners = self.preview.screen_corners
+        return QRect(corners[0][0]-1,
+                     corners[0][1]-1,
+                     corners[1][0]-corners[0][0]+2,
+                     corners[1][1]-corners[0][1]+2)
+
+    def label_positions(self, start, end_point):
+        halfx = (end_point.x() - start.x())/2+start.x()
+        halfy = (end_point.y() - start.y())/2+start.y()
+        return (QPointF(halfx, start.y()),
+                QPointF(end_point.x(), halfy),
+                QPointF(halfx, halfy-12))
+
+    def label_keys(self, start, end_point, ppix, ppiy):
+        # What each label's text depends on, so it's only formatted the first time
+        dx, dy = abs(end_point.x() - start.x()), abs(end_point.y() - start.y())
+        return (("x", dx, ppix), ("y", dy, ppiy), ("hip", dx, dy, ppix, ppiy))
+
+    def measurement_rect(self, start, end_point):
+        # Bounding rect of a triangle, its perpendicular marks and its labels
+        # Not QRect(start, end_point).normalized(), it doesn't swap the corners when they are 1px apart
+        left, right = min(start.x(), end_point.x()), max(start.x(), end_point.x())
+        top, bottom = min(start.y(), end_point.y()), max(start.y(), end_point.y())
+        rect = QRect(QPoint(left - 11, top - 11), QPoint(right + 11, bottom + 11))
+        for position in self.label_positions(start, end_point):
+            rect = rect.united(QRect(int(position.x()), int(position.y())-self.label_ascent,
+                                     self.label_width, self.label_height))
+        return rect
     
     def paintEvent(self, event):
         painter = QPainter()
         painter.begin(self)
+        if self.freeze.frozen():
+            # The screen under the overlay keeps changing, the snapshot is shown instead
+            pixmap = self.freeze.pixmap(self.origin[0], self.origin[1], self.origin[0] + self.h_res, self.origin[1] + self.v_res)
+            if pixmap is not None:
+                painter.drawPixmap(event.rect(), pixmap, event.rect())
         if not self.ignored:
-            self.paint_background(painter)
-        painter.setPen(QColor(255, 0, 255))
-        painter.setBrush(QColor(0, 0, 0))
+            with self.profiler.phase("background"):
+                self.paint_background(painter, event.rect())
 
-        for index, i in enumerate(self.initial_dots):
-            painter.setPen(QColor(255, 0, 255))
-            painter.drawRect(i.x()-1, i.y()-1, 2, 2)
-            try:
-                end_point = self.final_dots[index]
-                painter.setPen(QColor(0, 0, 255))
-                moving = False
-            except IndexError:
+        # The grid and the measurements stay out of the hole, it's what the magnifier and the edge snapping see
+        clean = self.clean_region(event.region())
+        if self.grid.visible():
+            self.grid.paint(painter, clean, self.h_res, self.v_res)
+
+        with self.profiler.phase("measurements"):
+            painter.save()
+            painter.setClipRegion(clean)
+            # Finished measurements never change, so they are drawn once into a cached layer
+            self.update_measurement_layer(event.region())
+            painter.drawPixmap(event.rect(), self.measurement_layer, event.rect())
+
+            if self.pending_start is not None:
                 # There is no end point, so cursor is end point
-                end_point = self.cursor().pos()
-                painter.setPen(QColor(0, 0, 255, 64))
-                moving = True
-
-            mid_point = QPoint(end_point.x(), i.y())
-            painter.drawPolyline(i, mid_point, end_point, i)
-            painter.setPen(QColor(255, 0, 255))
-            halfx = (mid_point.x() - i.x())/2+i.x()
-            halfy = (end_point.y() - mid_point.y())/2+mid_point.y()
-
-            # Draw perpendicular magenta lines in each of the triangle's sides' center
-            top_horizontal_half = QPoint(halfx, i.y()+10)
-            bot_horizontal_half = QPoint(halfx, i.y()-10)
-
-            left_vertical_half = QPoint(end_point.x()-10, halfy)
-            right_vertical_half = QPoint(end_point.x()+10, halfy)
-            try:
-                hipotenuse = math.sqrt((2*(halfx-i.x()))**2+(2*(halfy-mid_point.y()))**2)
-                scaling_factor = hipotenuse/10 # To ensure line length = 10
-                y_change = (2*(halfx-i.x()) / scaling_factor)
-                x_change = (2*(halfy-mid_point.y()) / scaling_factor)
-
-            except ZeroDivisionError:
-                y_change = 0
-                x_change = 0
-
-            top_hipotenuse_half = QPoint(halfx-x_change, halfy+y_change)
-            bot_hipotenuse_half = QPoint(halfx+x_change, halfy-y_change)
-
-            if hipotenuse >= 20 and moving: # To not be in the way while looking for a second point
-                painter.drawLine(top_horizontal_half, bot_horizontal_half)
-                painter.drawLine(left_vertical_half, right_vertical_half)
-                painter.drawLine(top_hipotenuse_half, bot_hipotenuse_half)
-
-            painter.setPen(QColor(255, 255, 255))
-            x_px = abs(int((halfx-i.x())*2)) + 1
-            y_px = abs(int((halfy-mid_point.y())*2)) + 1
-            hipotenuse = abs(hipotenuse)
-            inch_to_cm = 2.54
-            x_inches = x_px / self.ppix
-            y_inches = y_px / self.ppiy
-            hip_inches = hipotenuse / ((self.ppiy+self.ppix)/2)
-            x_cm = x_inches * inch_to_cm
-            y_cm = y_inches * inch_to_cm
-            hip_cm = hip_inches * inch_to_cm
-            x_text = str(x_px) + "px | " + f"{x_cm:7.2f}" + "cm | " + f"{x_inches:7.2f}" + "inch"
-            y_text = str(y_px) + "px | " + f"{y_cm:7.2f}" + "cm | " + f"{y_inches:7.2f}" + "inch"
-            hip_text = f"{abs(hipotenuse):7.2f}" + "px | " + f"{hip_cm:7.2f}" + "cm | " + f"{hip_inches:7.2f}" + "inch"
-            # in 7.2f -> 7 = max char, 2 = max floating point precision
-            if moving and hipotenuse >= 20: # To not be in the way while looking for a second point
-                painter.drawText(QPoint(halfx, i.y()), x_text)
-                painter.drawText(QPoint(end_point.x(), halfy), y_text)
-                painter.drawText(QPoint(halfx, halfy-12), hip_text) # 7 = max char, 2 = max floating point precision
-            elif not moving:
-                # drawStaticText is more optimized if it rarely updates
-                painter.drawStaticText(QPoint(halfx, i.y()), QStaticText(x_text))
-                painter.drawStaticText(QPoint(end_point.x(), halfy), QStaticText(y_text))
-                painter.drawStaticText(QPoint(halfx, halfy-12), QStaticText(hip_text))
+                self.paint_measurement(painter, self.pending_start, self.snapped(self.local_cursor_pos()), True)
+            painter.restore()
 
-        painter.setPen(QColor(255, 0, 255))
-        for i in self.final_dots:
-            painter.drawRect(i.x()-1, i.y()-1, 2, 2)
+        if self.inspector.enabled:
+            self.inspector.paint_selection(painter, self.origin)
+            pos = self.cursor().pos()
+            pixel = self.inspector.pixel(self.preview.capture, pos.x(), pos.y())
+            self.inspector.paint_panel(painter, self.hud_font, self.color_panel_rect(), pixel)
+
+        if self.freeze.frozen():
+            self.freeze.paint_panel(painter, self.hud_font, self.freeze_panel.geometry())
+
+        if self.profiler.enabled:
+            self.profiler.paint_hud(painter, self.hud_font, [self.label_cache.hud_line()], self.hud_panel.geometry())
 
         """if not self.ignored:
             self.paint_cursor(painter)"""
         painter.end()
         
-    def paint_background(self, painter):
+    def render_measurement_layer(self):
+        # The whole layer at once, without a time budget
+        self.measurement_layer.fill(Qt.transparent)
+        painter = QPainter(self.measurement_layer)
+        painter.setFont(self.font())
+        measurements = list(self.measurements)
+        texts = self.measurement_labels([measurement.id for measurement in measurements])
+        for measurement, text in zip(measurements, texts):
+            self.paint_measurement(painter, QPoint(measurement.x0, measurement.y0), QPoint(measurement.x1, measurement.y1), False, text)
+        painter.end()
+        self.layer_stale = QRegion()
+        self.layer_job = None
+
+    def update_measurement_layer(self, region):
+        # Draws the stale part of the layer inside region, one tile at a time, only with the
+        # measurements that touch the tile. When the budget runs out the rest of region is
+        # requested for the next frame, so a huge session doesn't freeze the window.
+        todo = self.layer_stale.intersected(region)
+        if todo.isEmpty():
+            return
+        deadline = time.perf_counter() + self.LAYER_BUDGET
+        painter = QPainter(self.measurement_layer)
+        painter.setFont(self.font())
+        if self.layer_job is not None and todo.intersects(self.layer_job[0]):
+            finished = self.draw_layer_tile(painter, *self.layer_job, deadline)
+        else:
+            finished = True
+        bounds = todo.boundingRect()
+        tile = self.LAYER_TILE
+        for y in range(bounds.top() // tile * tile, bounds.bottom() + 1, tile):
+            for x in range(bounds.left() // tile * tile, bounds.right() + 1, tile):
+                if not finished:
+                    break
+                rect = todo.intersected(QRect(x, y, tile, tile)).boundingRect()
+                if rect.isEmpty() or not self.layer_stale.intersects(rect):
+                    continue
+                painter.setClipping(False)
+                painter.setCompositionMode(QPainter.CompositionMode_Clear)
+                painter.fillRect(rect, Qt.transparent)
+                painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
+                ids = self.measurements.query_rect(rect.left(), rect.top(), rect.right()+1, rect.bottom()+1)
+                finished = self.draw_layer_tile(painter, rect, ids, 0, deadline)
+        painter.end()
+        remaining = self.layer_stale.intersected(region)
+        if not remaining.isEmpty():
+            self.scheduler.request(self, remaining)
+
+    def draw_layer_tile(self, painter, rect, ids, index, deadline):
+        # Draws ids[index:] clipped to rect, returns False if it stopped because of the deadline
+        painter.setClipRect(rect)
+        while index < len(ids):
+            chunk = ids[index:index + 256]
+            for id, text in zip(chunk, self.measurement_labels(chunk)):
+                measurement = self.measurements.get(id)
+                self.paint_measurement(painter, QPoint(measurement.x0, measurement.y0), QPoint(measurement.x1, measurement.y1), False, text)
+                index += 1
+                if time.perf_counter() > deadline and index < len(ids):
+                    self.layer_job = (rect, ids, index)
+                    return False
+        self.layer_job = None
+        self.layer_stale = self.layer_stale.subtracted(QRegion(rect))
+        return True
+
+    def invalidate_measurement_layer(self, rect=None):
+        # rect (everything if None) is drawn again the next time it's painted
+        if rect is None:
+            if self.measurement_layer is None:
+                self.measurement_layer = QPixmap(self.h_res, self.v_res)
+            self.measurement_layer.fill(Qt.transparent)
+            rect = QRect(0, 0, self.h_res, self.v_res)
+        self.layer_stale = self.layer_stale.united(QRegion(rect))
+        if self.layer_job is not None and self.layer_job[0].intersects(rect):
+            self.layer_job = None
+
+    def add_to_measurement_layer(self, id):
+        # A new measurement is drawn on top of the layer, no need to redraw the rest
+        measurement = self.measurements.get(id)
+        painter = QPainter(self.measurement_layer)
+        painter.setFont(self.font())
+        self.paint_measurement(painter, QPoint(measurement.x0, measurement.y0), QPoint(measurement.x1, measurement.y1),
+                               False, self.measurement_labels([id])[0])
+        painter.end()
+
+    def measurement_labels(self, ids):
+        # Label texts of stored measurements. They are computed once, all the missing ones in a single batch
+        store = self.measurements
+        missing = [id for id in ids if store.labels[id] is None]
+        if len(missing) == 1 or missing and np is None:
+            for id in missing:
+                measurement = store.get(id)
+                start, end_point = QPoint(measurement.x0, measurement.y0), QPoint(measurement.x1, measurement.y1)
+                store.labels[id] = labels(measure(measurement.x0, measurement.y0, measurement.x1, measurement.y1,
+                                                  *self.ppi_of(start, end_point)))
+        elif missing:
+            x0 = np.frombuffer(store.x0, dtype=np.intc)[missing]
+            y0 = np.frombuffer(store.y0, dtype=np.intc)[missing]
+            x1 = np.frombuffer(store.x1, dtype=np.intc)[missing]
+            y1 = np.frombuffer(store.y1, dtype=np.intc)[missing]
+            if self.auto_ppi:
+                ppi = np.array([self.monitors.ppi_along(*coords) for coords in
+                                zip((x0 + self.origin[0]).tolist(), (y0 + self.origin[1]).tolist(),
+                                    (x1 + self.origin[0]).tolist(), (y1 + self.origin[1]).tolist())])
+                ppix, ppiy = ppi[:, 0], ppi[:, 1]
+            else:
+                ppix, ppiy = self.ppix, self.ppiy
+            for id, text in zip(missing, labels_many(measure_many(x0, y0, x1, y1, ppix, ppiy))):
+                store.labels[id] = text
+        return [store.labels[id] for id in ids]
+
+    def add_measurement(self, start, end_point):
+        rect = self.measurement_rect(start, end_point)
+        id = self.measurements.add(start.x(), start.y(), end_point.x(), end_point.y(),
+                                   (rect.left(), rect.top(), rect.right()+1, rect.bottom()+1))
+        self.add_to_measurement_layer(id)
+        if self.session is not None:
+            self.session.add(id, start.x(), start.y(), end_point.x(), end_point.y())
+        self.scheduler.request(self, rect)
+        return id
+
+    def remove_measurement(self, id):
+        left, top, right, bottom = self.measurements.bounds(id)
+        rect = QRect(left, top, right-left, bottom-top)
+        self.measurements.remove(id)
+        self.invalidate_measurement_layer(rect)
+        self.scheduler.request(self, rect)
+        if self.session is not None:
+            self.session.remove([id])
+
+    def undo(self, redo=False):
+        if self.session is None:
+            return
+        changes = self.session.redo() if redo else self.session.undo()
+        if not changes:
+            return
+        for op, id in changes:
+            if op == REMOVE:
+                self.measurements.remove(id)
+            else:
+                self.measurements.restore(id)
+        if len(changes) == 1:
+            left, top, right, bottom = self.measurements.bounds(changes[0][1])
+            rect = QRect(left, top, right-left, bottom-top)
+            self.invalidate_measurement_layer(rect)
+            self.scheduler.request(self, rect)
+        else:
+            self.invalidate_measurement_layer()
+            self.scheduler.request(self)
+
+    def paint_measurement(self, painter, i, end_point, moving, texts=None):
+        # texts: the labels if they are already known, otherwise they are computed here
+        painter.setBrush(QColor(0, 0, 0))
+        painter.setPen(QColor(255, 0, 255))
+        painter.drawRect(i.x()-1, i.y()-1, 2, 2)
+        if moving:
+            painter.setPen(QColor(0, 0, 255, 64))
+        else:
+            painter.setPen(QColor(0, 0, 255))
+
+        mid_point = QPoint(end_point.x(), i.y())
+        painter.drawPolyline(i, mid_point, end_point, i)
+        painter.setPen(QColor(255, 0, 255))
+        halfx = (mid_point.x() - i.x())/2+i.x()
+        halfy = (end_point.y() - mid_point.y())/2+mid_point.y()
+
+        # Draw perpendicular magenta lines in each of the triangle's sides' center
+        top_horizontal_half = QPointF(halfx, i.y()+10)
+        bot_horizontal_half = QPointF(halfx, i.y()-10)
+
+        left_vertical_half = QPointF(end_point.x()-10, halfy)
+        right_vertical_half = QPointF(end_point.x()+10, halfy)
+        try:
+            hipotenuse = math.sqrt((2*(halfx-i.x()))**2+(2*(halfy-mid_point.y()))**2)
+            scaling_factor = hipotenuse/10 # To ensure line length = 10
+            y_change = (2*(halfx-i.x()) / scaling_factor)
+            x_change = (2*(halfy-mid_point.y()) / scaling_factor)
+
+        except ZeroDivisionError:
+            y_change = 0
+            x_change = 0
+
+        top_hipotenuse_half = QPointF(halfx-x_change, halfy+y_change)
+        bot_hipotenuse_half = QPointF(halfx+x_change, halfy-y_change)
+
+        if hipotenuse >= 20 and moving: # To not be in the way while looking for a second point
+            painter.drawLine(top_horizontal_half, bot_horizontal_half)
+            painter.drawLine(left_vertical_half, right_vertical_half)
+            painter.drawLine(top_hipotenuse_half, bot_hipotenuse_half)
+
+        with self.profiler.phase("text"):
+            if not moving or hipotenuse >= 20: # To not be in the way while looking for a second point
+                painter.setPen(QColor(255, 255, 255))
+                if texts is None:
+                    ppix, ppiy = self.ppi_of(i, end_point)
+                    keys = self.label_keys(i, end_point, ppix, ppiy)
+                    make_texts = lambda: labels(measure(i.x(), i.y(), end_point.x(), end_point.y(), ppix, ppiy))
+                else:
+                    keys = texts
+                    make_texts = lambda: texts
+                # The positions are baselines, static texts are drawn from their top left corner
+                for position, static in zip(self.label_positions(i, end_point),
+                                            self.label_cache.get(keys, painter.font(), make_texts)):
+                    painter.drawStaticText(QPointF(position.x(), position.y() - self.label_ascent), static)
+
+        painter.setPen(QColor(255, 0, 255))
+        if not moving:
+            painter.drawRect(end_point.x()-1, end_point.y()-1, 2, 2)
+
+    def paint_background(self, painter, dirty_rect):
         painter.setBrush(QColor(0, 0, 0, 120)) # Semitransparent brush
         painter.setPen(Qt.NoPen)
         corners = self.preview.screen_corners
 
-        # drawRect(left margin, top margin, width, height)
+        # QRect(left margin, top margin, width, height)
         # corners[0] = top left corner
         # corners[1] = bot right corner
         # corners[][0] = x component
         # corners[][1] = y component
+        rects = [
+            # black rectangle
+            # topleft corner =  (screen left, screen top)
+            # botright corner = (preview left, screen bottom)
+            QRect(0,
+                  0,
+                  corners[0][0],
+                  self.v_res
+            ),
+            # black rectangle
+            # topleft corner =  (preview left, screen top)
+            # botright corner = (preview right, preview top)
+            QRect(corners[0][0],
+                  0,
+                  corners[1][0]-corners[0][0],
+                  corners[0][1]
+            ),
+            # black rectangle
+            # topleft corner =  (preview left, preview bottom)
+            # botright corner = (preview right, screen bottom)
+            QRect(corners[0][0],
+                  corners[1][1],
+                  corners[1][0]-corners[0][0],
+                  self.v_res - corners[1][1]
+            ),
+            # black rectangle
+            # topleft corner =  (preview right, screen top)
+            # botright corner = (preview right, screen bot)
+            QRect(corners[1][0],
+                  0,
+                  self.h_res - corners[1][0],
+                  self.v_res
+            )
+        ]
+        # Only the part of each rectangle that has to be repainted is filled
+        for rect in rects:
+            rect = rect.intersected(dirty_rect)
+            if not rect.isEmpty():
+                painter.drawRect(rect)
 
-        # black rectangle
-        # topleft corner =  (screen left, screen top)
-        # botright corner = (preview left, screen bottom)
-        painter.drawRect(0,
-                         0,
-                         corners[0][0],
-                         self.v_res
-        )
-        # black rectangle
-        # topleft corner =  (preview left, screen top)
-        # botright corner = (preview right, preview top)
-        painter.drawRect(corners[0][0],
-                         0,
-                         corners[1][0]-corners[0][0],
-                         corners[0][1]
-        )
-        # black rectangle
-        # topleft corner =  (preview left, preview bottom)
-        # botright corner = (preview right, screen bottom)
-        painter.drawRect(corners[0][0],
-                         corners[1][1],
-                         corners[1][0]-corners[0][0],
-                         self.v_res - corners[1][1]
-        )
-        # black rectangle
-        # topleft corner =  (preview right, screen top)
-        # botright corner = (preview right, screen bot)
-        painter.drawRect(corners[1][0],
-                         0,
-                         self.h_res - corners[1][0],
-                         self.v_res
-        )
         painter.setPen(QColor(255, 255, 255, 1)) # Almost transparent brush, just so there is something there
         painter.setBrush(QColor(0, 0, 0, 1)) # Almost transparent brush, just so there is something there
         # transparent rectangle with blue border
@@ -188,23 +630,69 @@ class RulerWindow(QWidget):
         )"""
 
     def mousePressEvent(self, event):
-        if len(self.initial_dots) == len(self.final_dots):
-            self.initial_dots.append(event.pos())
+        if event.button() == Qt.RightButton:
+            # Delete the measurement under the cursor
+            id = self.measurements.hit_test(event.pos().x(), event.pos().y())
+            if id is not None:
+                self.remove_measurement(id)
+        elif self.inspector.enabled:
+            # Drag a rectangle to get its color statistics
+            dirty = QRegion(self.selection_rect()).united(self.color_panel_rect())
+            x, y = event.pos().x() + self.origin[0], event.pos().y() + self.origin[1]
+            if self.inspector.dragging:
+                # The enter key only presses, the second press ends the selection
+                self.inspector.end_selection()
+            elif self.freeze.frozen():
+                self.inspector.start_selection(self.preview.capture, x, y)
+            else:
+                # The live capture has the overlay in it, only the hole is clean, so the
+                # statistics come from a snapshot: the selection starts once it's frozen.
+                # A real press is a drag, the Enter key only presses
+                self.pending_selection = (x, y, event.spontaneous())
+                self.take_snapshot()
+            self.scheduler.request(self, dirty.united(self.selection_rect()))
+        elif self.pending_start is None:
+            self.pending_start = self.snapped(event.pos())
+            self.moving_rect = self.measurement_rect(self.pending_start, self.snapped(self.local_cursor_pos()))
+            self.scheduler.request(self, self.moving_rect)
         else:
-            self.final_dots.append(event.pos())
-        self.repaint()
-        self.preview.update()
+            self.add_measurement(self.pending_start, self.snapped(event.pos()))
+            self.pending_start = None
+            self.scheduler.request(self, self.moving_rect)
+            self.moving_rect = QRect()
+        self.scheduler.request(self.preview)
+
+    def mouseReleaseEvent(self, event):
+        if self.inspector.dragging and event.button() == Qt.LeftButton:
+            self.inspector.end_selection()
 
     def mouseDoubleClickEvent(self, event):
-        self.final_dots = []
-        self.initial_dots = []
-        self.update()
-        self.preview.update()
+        if event.button() == Qt.RightButton:
+            # Two quick right clicks are two deletes, not a double click
+            self.mousePressEvent(event)
+            return
+        if event.button() != Qt.LeftButton:
+            return
+        if self.inspector.enabled:
+            # Only clears the color selection, the measurements stay
+            self.pending_selection = None
+            self.scheduler.request(self, QRegion(self.selection_rect()).united(self.color_panel_rect()))
+            self.inspector.clear_selection()
+            return
+        ids = self.measurements.remove_all()
+        if self.session is not None:
+            # A single action, so it can be undone
+            self.session.remove(ids)
+        self.pending_start = None
+        self.moving_rect = QRect()
+        self.invalidate_measurement_layer()
+        self.scheduler.request(self)
+        self.scheduler.request(self.preview)
 
     def mouseMoveEvent(self, event):
-        self.preview.update_pos()
-        self.repaint()
-        self.preview.update()
+        # The dirty area of the overlay is requested in new_frame, the magnifier a frame later
+        self.cursor_moved = True
+        self.scheduler.request_frame()
             
     def keyPressEvent(self, event):
         key = event.key()
@@ -223,10 +711,105 @@ class RulerWindow(QWidget):
             cursor.setPos(new_x, new_y)
         elif key == 80: # P key
             self.ignore_input(not self.ignored)
+        elif key == 83: # S key
+            self.snapper.toggle()
+            self.scheduler.request(self)
+        elif key == 90 and event.modifiers() & Qt.ControlModifier: # Ctrl+Z, Ctrl+Shift+Z
+            self.undo(redo=bool(event.modifiers() & Qt.ShiftModifier))
+        elif key == 89 and event.modifiers() & Qt.ControlModifier: # Ctrl+Y
+            self.undo(redo=True)
+        elif key == 67: # C key
+            self.scheduler.request(self, QRegion(self.selection_rect()).united(self.color_panel_rect()))
+            self.inspector.toggle()
+        elif key == 71: # G key
+            if event.modifiers() & Qt.ShiftModifier:
+                self.grid.next_spacing()
+            else:
+                self.grid.cycle_mode()
+            self.scheduler.request(self)
+        elif key in [72, 86]: # H and V keys
+            # Guide through the cursor, or remove the one that is there
+            pos = self.snapped(self.local_cursor_pos())
+            vertical = key == 86
+            self.scheduler.request(self, self.grid.toggle_guide(vertical, pos.x() if vertical else pos.y(), self.h_res, self.v_res))
+        elif key == 70: # F key
+            if self.freeze.frozen():
+                self.show_snapshot(None)
+            else:
+                self.take_snapshot()
+        elif key in [16777238, 16777239]: # Page up and page down keys
+            # Older and newer snapshots
+            if self.freeze.snapshots:
+                self.show_snapshot(self.freeze.step(-1 if key == 16777238 else 1))
+        elif key == 73: # I key
+            self.scheduler.request(self, self.hud_panel.geometry())
+            self.profiler.toggle()
+        elif key in [43, 61, 45]: # +, = and - keys
+            zoom = self.preview.pixel_size + (1 if key != 45 else -1)
+            self.set_magnifier(self.preview.M_SIZE, zoom)
+        elif key in [91, 93]: # [ and ] keys
+            step = 10 if key == 93 else -10
+            size = self.preview.M_SIZE[0] + step
+            self.set_magnifier((size, size), self.preview.pixel_size)
         elif key == 16777220: # Enter key
             # Simulate click
-            self.mousePressEvent(self.cursor())
-        self.preview.repaint()
+            self.mousePressEvent(QMouseEvent(QEvent.MouseButtonPress, self.local_cursor_pos(), Qt.LeftButton, Qt.LeftButton, Qt.NoModifier))
+        self.scheduler.request(self.preview)
+
+    def take_snapshot(self):
+        # The overlay would be in the snapshot, so it's hidden until the desktop has been grabbed
+        if self.snapshot_pending:
+            return
+        self.snapshot_pending = True
+        self.hide()
+        QTimer.singleShot(self.SNAPSHOT_DELAY, self.request_snapshot)
+
+    def request_snapshot(self):
+        # A threaded capture grabs it on its worker and then emits frame_ready, the others right away
+        self.snapshot_timer.start(self.SNAPSHOT_TIMEOUT)
+        self.live_capture.request_snapshot(self.monitors.desktop_bounds())
+        self.freeze_frame()
+
+    def freeze_frame(self):
+        # Freezes on the requested snapshot once it's there
+        if not self.snapshot_pending:
+            return
+        result = self.live_capture.take_snapshot()
+        if result is None:
+            return
+        self.snapshot_pending = False
+        self.snapshot_timer.stop()
+        buffer, bbox = result
+        if buffer is not None:
+            self.show_snapshot(self.freeze.take(buffer, bbox))
+            if self.pending_selection is not None:
+                x, y, dragged = self.pending_selection
+                self.inspector.start_selection(self.preview.capture, x, y)
+                if dragged and not QApplication.mouseButtons() & Qt.LeftButton:
+                    # Released while the ruler was hidden, the release never reached it
+                    pos = QCursor.pos()
+                    self.inspector.update_selection(pos.x(), pos.y())
+                    self.inspector.end_selection()
+        self.pending_selection = None
+        # When it failed the magnifier shows why
+        self.showFullScreen()
+
+    def snapshot_timed_out(self):
+        if self.snapshot_pending:
+            self.snapshot_pending = False
+            self.pending_selection = None
+            self.showFullScreen()
+
+    def show_snapshot(self, snapshot):
+        # None goes back to the live screen
+        if snapshot is None:
+            self.freeze.thaw()
+            self.preview.capture = self.live_capture
+            self.live_capture.invalidate()
+        else:
+            self.preview.capture = snapshot
+        self.scheduler.request(self)
+        self.scheduler.request(self.preview)
 
     def ignore_input(self, ignore=True):
         self.ignored = ignore
@@ -242,24 +825,42 @@ class RulerWindow(QWidget):
         else:
             self.preview.show()
             cursor = Qt.BlankCursor
+        self.magnifier_item.invalidate()
         self.setCursor(cursor)
 
-    def generate_custom_cursor(self):
-        print(QPixmap.defaultDepth())
-        bitmap = QPixmap(QSize(32, 32))
-        mask = QPixmap(QSize(32, 32))
+    def set_magnifier(self, size, zoom):
+        size = (min(max(size[0], 5), 101), min(max(size[1], 5), 101))
+        zoom = min(max(zoom, 2), 20)
+        self.preview.set_magnifier(size, zoom)
+        self.magnifier_item.invalidate()
+        self.custom_cursor = self.get_custom_cursor(self.preview.M_SIZE)
+        if not self.ignored:
+            self.setCursor(self.custom_cursor)
+        self.scheduler.request(self)
+        self.scheduler.request(self.preview)
+
+    def get_custom_cursor(self, size):
+        if size not in self.cursors:
+            self.cursors[size] = self.generate_custom_cursor(size)
+        return self.cursors[size]
+
+    def generate_custom_cursor(self, size):
+        x, y = size
+        # 32x32 is the smallest cursor, bigger magnifiers need a bigger one
+        side = max(32, (max(x, y) + 3 + 7)//8*8)
+        bitmap = QPixmap(QSize(side, side))
+        mask = QPixmap(QSize(side, side))
         bitmap.fill(QColor("#ffffff"))
         mask.fill(QColor("#ffffff"))
 
-        x, y = Preview.M_SIZE
         painter = QPainter(bitmap)
         painter.setPen(QColor("#000000"))
         painter.drawRect(0, 0, x+2, y+2)
-        painter.drawLine(x/2+2, 1, x/2+2, y+1)
-        painter.drawLine(1, y/2+2, x+1, y/2+2)
+        painter.drawLine(x//2+2, 1, x//2+2, y+1)
+        painter.drawLine(1, y//2+2, x+1, y//2+2)
         painter.end()
 
-        return QCursor(QBitmap(bitmap), QBitmap(mask),(x+2)/2, (y+2)/2)
+        return QCursor(QBitmap(bitmap), QBitmap(mask), (x+2)//2, (y+2)//2)
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
@@ -0,0 +1,236 @@
+# Session log: every change to the measurements is appended to a binary file,
+# so they survive closing the program (or an accidental double click).
+# python session.py screenruler_session.log --csv measurements.csv --json measurements.json --ppi 96
+#
+# The file is a sequence of fixed size records (op, kind, action, id, x0, y0, x1, y1):
+#   ADD     a new measurement with that id and points
+#   REMOVE  the measurement with that id is deleted
+#   RESTORE the deleted measurement with that id is back
+# All the records of one user action (clearing everything is a single action)
+# share the action number. kind tells whether the action was done by the user,
+# or is an undo or a redo of a previous action, which are logged as the REMOVE
+# and RESTORE records that revert or repeat it. Nothing is ever rewritten.
+#
+# Loading doesn't replay the records one by one: the file is memory-mapped as
+# a numpy array, and the final state of every id is the op of the last record
+# that touches it.
+# If the log can't be read or written (a folder without write access...) the
+# session goes on, with undo and redo, but nothing more is saved.
+import argparse
+import csv
+import json
+import os
+import struct
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from dimensions import measure, measure_many
+
+ADD, REMOVE, RESTORE = 1, 2, 3
+DO, UNDO, REDO = 0, 1, 2
+
+RECORD = struct.Struct("<BBxxiiiiii")
+if np is not None:
+    RECORD_DTYPE = np.dtype([("op", "u1"), ("kind", "u1"), ("pad", "u2"), ("action", "<i4"), ("id", "<i4"),
+                             ("x0", "<i4"), ("y0", "<i4"), ("x1", "<i4"), ("y1", "<i4")])
+
+EXPORT_CHUNK = 10000
+EXPORT_FIELDS = ["id", "x0", "y0", "x1", "y1", "x_px", "y_px", "hip_px",
+                 "x_cm", "y_cm", "hip_cm", "x_inches", "y_inches", "hip_inches"]
+
+class SessionLog():
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.saving = True
+        self.action = 0
+        self.undo_stack = [] # actions that can be undone, as [(op, id), ...] of their records
+        self.redo_stack = []
+
+    def load(self):
+        # Measurements of the session as (ids, x0, y0, x1, y1, alive), None if there is no session yet.
+        # ids are 0..n-1, an id without an ADD record (records lost) is a removed measurement
+        try:
+            return self.read()
+        except OSError as e:
+            self.stop_saving(e)
+            return None
+
+    def read(self):
+        if not os.path.exists(self.path):
+            return None
+        size = os.path.getsize(self.path)
+        if size % RECORD.size:
+            # The program was closed while writing, the last record is incomplete
+            with open(self.path, "r+b") as f:
+                f.truncate(size - size % RECORD.size)
+            size -= size % RECORD.size
+        if size == 0:
+            return None
+        if np is None:
+            return self.load_records(list(RECORD.iter_unpack(open(self.path, "rb").read())))
+
+        records = np.memmap(self.path, dtype=RECORD_DTYPE, mode="r")
+        ops, ids = records["op"], records["id"]
+        adds = records[ops == ADD]
+        count = int(ids.max()) + 1
+        # Last record of every id
+        last = np.full(count, -1, dtype=np.int64)
+        np.maximum.at(last, ids, np.arange(len(records)))
+        added = np.zeros(count, dtype=bool)
+        added[adds["id"]] = True
+        alive = added & (ops[last] != REMOVE)
+
+        points = [np.zeros(count, dtype=np.int32) for _ in range(4)]
+        for column, name in zip(points, ("x0", "y0", "x1", "y1")):
+            column[adds["id"]] = adds[name]
+        measurements = (np.arange(count), *points, alive)
+        self.load_history(records["action"], records["kind"], ops, ids)
+        del records
+        return measurements
+
+    def load_records(self, records):
+        # Same as load, without numpy
+        state = {}
+        points = {}
+        for op, kind, action, id, x0, y0, x1, y1 in records:
+            state[id] = op != REMOVE
+            if op == ADD:
+                points[id] = (x0, y0, x1, y1)
+        ids = list(range(max(state) + 1))
+        self.load_history(*zip(*[(r[2], r[1], r[0], r[3]) for r in records]))
+        alive = [id in points and state[id] for id in ids]
+        points = [points.get(id, (0, 0, 0, 0)) for id in ids]
+        return (ids, [p[0] for p in points], [p[1] for p in points], [p[2] for p in points], [p[3] for p in points], alive)
+
+    def load_history(self, actions, kinds, ops, ids):
+        # Rebuilds the undo and redo stacks by going through the actions in order
+        if np is not None:
+            actions = np.asarray(actions)
+            starts = np.flatnonzero(np.diff(actions, prepend=actions[0] - 1)).tolist()
+            ops, ids, kinds = np.asarray(ops).tolist(), np.asarray(ids).tolist(), np.asarray(kinds).tolist()
+            last_action = int(actions[-1])
+        else:
+            starts = [i for i in range(len(actions)) if i == 0 or actions[i] != actions[i-1]]
+            last_action = actions[-1]
+        ends = starts[1:] + [len(ops)]
+        for start, end in zip(starts, ends):
+            kind = kinds[start]
+            if kind == DO:
+                self.undo_stack.append(list(zip(ops[start:end], ids[start:end])))
+                self.redo_stack = []
+            elif kind == UNDO:
+                self.redo_stack.append(self.undo_stack.pop())
+            else:
+                self.undo_stack.append(self.redo_stack.pop())
+        self.action = last_action + 1
+
+    def write(self, records, kind):
+        # One action, records are (op, id, x0, y0, x1, y1)
+        if self.saving:
+            try:
+                if self.file is None:
+                    self.file = open(self.path, "ab")
+                self.file.write(b"".join(RECORD.pack(op, kind, self.action, id, x0, y0, x1, y1)
+                                         for op, id, x0, y0, x1, y1 in records))
+                self.file.flush()
+            except OSError as e:
+                self.stop_saving(e)
+        self.action += 1
+
+    def stop_saving(self, error):
+        print("session not saved:", error, file=sys.stderr)
+        self.saving = False
+        try:
+            self.close()
+        except OSError:
+            pass
+
+    def add(self, id, x0, y0, x1, y1):
+        self.write([(ADD, id, x0, y0, x1, y1)], DO)
+        self.done([(ADD, id)])
+
+    def remove(self, ids):
+        if not ids:
+            return
+        self.write([(REMOVE, id, 0, 0, 0, 0) for id in ids], DO)
+        self.done([(REMOVE, id) for id in ids])
+
+    def done(self, changes):
+        self.undo_stack.append(changes)
+        self.redo_stack = []
+
+    def undo(self):
+        # Changes to apply to the measurements, [(REMOVE or RESTORE, id), ...], None if there's nothing to undo
+        if not self.undo_stack:
+            return None
+        changes = self.undo_stack.pop()
+        self.redo_stack.append(changes)
+        reverted = [(REMOVE if op != REMOVE else RESTORE, id) for op, id in reversed(changes)]
+        self.write([(op, id, 0, 0, 0, 0) for op, id in reverted], UNDO)
+        return reverted
+
+    def redo(self):
+        if not self.redo_stack:
+            return None
+        changes = self.redo_stack.pop()
+        self.undo_stack.append(changes)
+        repeated = [(REMOVE if op == REMOVE else RESTORE, id) for op, id in changes]
+        self.write([(op, id, 0, 0, 0, 0) for op, id in repeated], REDO)
+        return repeated
+
+    def close(self):
+        if self.file is not None:
+            file, self.file = self.file, None
+            file.close()
+
+def export_rows(measurements, ppix, ppiy):
+    # Rows of the alive measurements with their dimensions, EXPORT_CHUNK at a time
+    ids, x0, y0, x1, y1, alive = measurements
+    if np is None:
+        for row in zip(ids, x0, y0, x1, y1, alive):
+            if row[5]:
+                yield dict(zip(EXPORT_FIELDS, row[:5]), **measure(*row[1:5], ppix, ppiy))
+        return
+    keep = np.flatnonzero(np.asarray(alive))
+    for start in range(0, len(keep), EXPORT_CHUNK):
+        chunk = keep[start:start + EXPORT_CHUNK]
+        columns = [np.asarray(column)[chunk] for column in (ids, x0, y0, x1, y1)]
+        dimensions = measure_many(*columns[1:], ppix, ppiy)
+        values = columns + [dimensions[field] for field in EXPORT_FIELDS[5:]]
+        for row in zip(*[np.broadcast_to(value, (len(chunk),)).tolist() for value in values]):
+            yield dict(zip(EXPORT_FIELDS, row))
+
+def export_csv(measurements, path, ppix, ppiy):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, EXPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(export_rows(measurements, ppix, ppiy))
+
+def export_json(measurements, path, ppix, ppiy):
+    # A JSON array written one measurement at a time
+    with open(path, "w") as f:
+        f.write("[")
+        for index, row in enumerate(export_rows(measurements, ppix, ppiy)):
+            f.write(("\n" if index == 0 else ",\n") + json.dumps(row))
+        f.write("\n]\n")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the measurements of a Screen Ruler session")
+    parser.add_argument("log", help="session log, screenruler_session.log by default in the program's folder")
+    parser.add_argument("--csv", help="write the measurements to this CSV file")
+    parser.add_argument("--json", help="write the measurements to this JSON file")
+    parser.add_argument("--ppi", type=float, default=96, help="pixels per inch used for the cm and inch values")
+    args = parser.parse_args()
+
+    measurements = SessionLog(args.log).load()
+    if measurements is None:
+        sys.exit("empty session: " + args.log)
+    if args.csv:
+        export_csv(measurements, args.csv, args.ppi, args.ppi)
+    if args.json:
+        export_json(measurements, args.json, args.ppi, args.ppi)
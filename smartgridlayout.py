@@ -1,44 +1,209 @@
-from PyQt5.QtWidgets import QLayout
-from PyQt5.QtCore import QSize, QRect
+from PyQt5.QtWidgets import QLayout, QLayoutItem, QWidget
+from PyQt5.QtCore import QSize, QRect, QPoint, Qt
+from PyQt5.QtGui import QRegion
 
-class SmartGridItem():
-    def __init__(self, widget, left=0, top=0, right=0, bot=0):
+# Rows of items, each row is placed under the previous one and the items of a row
+# are placed left to right. Each item keeps its size and its position inside the
+# layout, and they are only computed again for the items that were invalidated
+# (and the items after them), so placing the layout somewhere else only moves
+# the items whose rectangle actually changed.
+# The items can be widgets or Panels, rectangles that something else paints.
+class SmartGridItem(QLayoutItem):
+    def __init__(self, content, left=0, top=0, right=0, bot=0):
+        super().__init__()
         self.padding = (left, top, right, bot)
-        self.widget = widget
+        self.content = content
+        self.layout = None
+        self.dirty = True
+        self.size = QSize(0, 0) # Size of the content, without the padding
+        self.offset = QPoint(0, 0) # Position of the content relative to the layout
+        self.rect = QRect()
+
+    def invalidate(self):
+        # The content changed its size or was shown/hidden
+        self.dirty = True
+        if self.layout is not None:
+            self.layout.dirty = True
+
+    def update_size(self):
+        if self.dirty:
+            self.dirty = False
+            if self.content.isHidden():
+                self.size = QSize(0, 0)
+            else:
+                self.size = QSize(self.content.width(), self.content.height())
+
+    def isEmpty(self):
+        self.update_size()
+        return self.size.isEmpty()
+
+    def sizeHint(self):
+        self.update_size()
+        left, top, right, bot = self.padding
+        return QSize(left + self.size.width() + right, top + self.size.height() + bot)
+
+    def minimumSize(self):
+        return self.sizeHint()
+
+    def maximumSize(self):
+        return self.sizeHint()
+
+    def expandingDirections(self):
+        return Qt.Orientations()
+
+    def geometry(self):
+        return self.rect
+
+    def setGeometry(self, rect):
+        self.rect = rect
+        self.content.setGeometry(rect)
+
+    def widget(self):
+        if isinstance(self.content, QWidget):
+            return self.content
+        return None
 
 class SmartGridLayout(QLayout):
     def __init__(self, parent, shape):
         super().__init__(parent)
 
-        self.shape = shape
-        self.setGeometry(QRect(0, 0, 0, 0))
+        self.rows = []
+        self.dirty = True
+        self.first_dirty_row = 0 # Rows were added or removed from here on
+        self.row_extents = [] # (width, bottom) of each row, relative to the layout
+        self.size = QSize(0, 0)
+        self.origin = QPoint(0, 0)
+        self.changed = QRegion() # Area of the items that moved since take_changed
+        for row in shape:
+            self.add_row(row)
 
-    def setGeometry(self, rect):
-        if len(self.shape) == 0:
+    def add_row(self, row=()):
+        self.rows.append([])
+        for item in row:
+            self.addItem(item)
+
+    def addItem(self, item):
+        # Appended to the last row, widgets added with addWidget arrive here as a QWidgetItem
+        if not isinstance(item, SmartGridItem):
+            widget = item.widget() if isinstance(item, QLayoutItem) else item
+            item = SmartGridItem(widget)
+        if not self.rows:
+            self.rows.append([])
+        item.layout = self
+        self.rows[-1].append(item)
+        item.invalidate()
+        self.first_dirty_row = min(self.first_dirty_row, len(self.rows) - 1)
+
+    def items(self):
+        return [item for row in self.rows for item in row]
+
+    def count(self):
+        return len(self.items())
+
+    def itemAt(self, index):
+        items = self.items()
+        if 0 <= index < len(items):
+            return items[index]
+        return None
+
+    def takeAt(self, index):
+        item = self.itemAt(index)
+        if item is None:
+            return None
+        for row_index, row in enumerate(self.rows):
+            if item in row:
+                row.remove(item)
+                self.first_dirty_row = min(self.first_dirty_row, row_index)
+        item.layout = None
+        self.dirty = True
+        return item
+
+    def invalidate(self):
+        # Everything is measured again
+        for item in self.items():
+            item.dirty = True
+        self.dirty = True
+        self.first_dirty_row = 0
+        super().invalidate()
+
+    def update_layout(self):
+        # Positions relative to the layout, from the first row with an invalidated item
+        if not self.dirty:
             return
+        self.dirty = False
+        first = self.first_dirty_row
+        for index, row in enumerate(self.rows[:first]):
+            if any(item.dirty for item in row):
+                first = index
+                break
+        del self.row_extents[first:]
+        top = self.row_extents[-1][1] if self.row_extents else 0
+        for row in self.rows[first:]:
+            x = 0
+            row_height = 0
+            for item in row:
+                if item.isEmpty():
+                    # Hidden items don't take space, not even their padding
+                    item.offset = QPoint(x, top)
+                    continue
+                left, item_top, right, bot = item.padding
+                item.offset = QPoint(x + left, top + item_top)
+                x += left + item.size.width() + right
+                row_height = max(row_height, item_top + item.size.height() + bot)
+            top += row_height
+            self.row_extents.append((x, top))
+        self.first_dirty_row = len(self.rows)
+        width = max([row_width for row_width, bottom in self.row_extents] + [0])
+        self.size = QSize(width, top)
+
+    def setGeometry(self, rect):
+        # Only the items whose rectangle changed are moved
+        super().setGeometry(rect)
+        self.update_layout()
+        self.origin = rect.topLeft()
+        for item in self.items():
+            if item.isEmpty():
+                if not item.rect.isNull():
+                    self.changed = self.changed.united(item.rect)
+                    item.rect = QRect()
+                continue
+            new_rect = QRect(self.origin + item.offset, item.size)
+            if new_rect != item.rect:
+                self.changed = self.changed.united(item.rect).united(new_rect)
+                item.setGeometry(new_rect)
+
+    def take_changed(self):
+        changed = self.changed
+        self.changed = QRegion()
+        return changed
 
-        self.x_position = rect.x()
-        self.lowest_point = rect.y()
-        new_lowest_point = 0
-        for i in self.shape:
-            for j in i:
-                if type(j) != SmartGridItem:
-                    padding = (0, 0, 0, 0)
-                    widget = j
-                else:
-                    padding = j.padding
-                    widget = j.widget
-
-                widget.setGeometry(self.x_position + padding[0], self.lowest_point + padding[1], widget.width(), widget.height())
-
-                if new_lowest_point < self.lowest_point + padding[1] + widget.height():
-                    new_lowest_point = self.lowest_point + padding[1] + widget.height()
-                self.x_position += padding[0] + widget.width()
-            if new_lowest_point > self.lowest_point:
-                self.lowest_point = new_lowest_point
-    
     def sizeHint(self):
-        return QSize(self.x_position, self.lowest_point)
-    
+        self.update_layout()
+        return QSize(self.size)
+
     def minimumSize(self):
-        return QSize(self.x_position, self.lowest_point)
\ No newline at end of file
+        return self.sizeHint()
+
+# A rectangle of the layout painted by its owner instead of a widget
+class Panel():
+    def __init__(self, width=0, height=0, hidden=False):
+        self.rect = QRect(0, 0, width, height)
+        self.hidden = hidden
+
+    def isHidden(self):
+        return self.hidden
+
+    def width(self):
+        return self.rect.width()
+
+    def height(self):
+        return self.rect.height()
+
+    def resize(self, width, height):
+        self.rect.setSize(QSize(width, height))
+
+    def geometry(self):
+        return self.rect
+
+    def setGeometry(self, rect):
+        self.rect = QRect(rect)
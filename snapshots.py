@@ -0,0 +1,81 @@
+import collections
+import os
+
+from PyQt5.QtCore import QPoint, Qt
+from PyQt5.QtGui import QColor, QFontMetrics, QPixmap
+
+from capture import SnapshotCapture
+from preview import to_qimage
+
+# Freeze frame: the whole virtual desktop is grabbed once and the ruler measures
+# that snapshot instead of the screen. While frozen the snapshot replaces the
+# capture source of the magnifier, so the magnifier, the edge snapping and the
+# color readout all read it, and the live capture isn't asked for a single grab.
+# The last SCREENRULER_SNAPSHOTS snapshots (4 by default) are kept so they can
+# be stepped through, each one is converted to a pixmap for the overlay the
+# first time it's shown.
+class FreezeFrame():
+    def __init__(self, size=None):
+        if size is None:
+            size = int(os.environ.get("SCREENRULER_SNAPSHOTS", "4"))
+        self.snapshots = collections.deque(maxlen=max(size, 1))
+        self.index = None # Index of the snapshot shown, None = live
+        self.count = 0
+        self.pixmaps = {} # (frame_id, area) -> QPixmap of that area of the snapshot
+
+    def frozen(self):
+        return self.index is not None
+
+    def current(self):
+        if self.index is None:
+            return None
+        return self.snapshots[self.index]
+
+    def take(self, buffer, bbox):
+        # Freezes on a snapshot of bbox (see CaptureSource.request_snapshot)
+        self.count += 1
+        self.snapshots.append(SnapshotCapture(buffer, bbox, -self.count))
+        self.index = len(self.snapshots) - 1
+        alive = {snapshot.frame_id for snapshot in self.snapshots}
+        self.pixmaps = {key: pixmap for key, pixmap in self.pixmaps.items() if key[0] in alive}
+        return self.current()
+
+    def step(self, offset):
+        # Older (negative offset) or newer snapshot, from live it starts at the newest one
+        if not self.snapshots:
+            return None
+        if self.index is None:
+            self.index = len(self.snapshots) - 1
+        else:
+            self.index = min(max(self.index + offset, 0), len(self.snapshots) - 1)
+        return self.current()
+
+    def thaw(self):
+        self.index = None
+
+    def pixmap(self, left, top, right, bottom):
+        # Area of the current snapshot in global coordinates, None when it isn't in the snapshot
+        snapshot = self.current()
+        key = (snapshot.frame_id, (left, top, right, bottom))
+        if key not in self.pixmaps:
+            patch = snapshot.region(left, top, right, bottom)
+            if patch is None:
+                return None
+            image, data = to_qimage(patch)
+            # fromImage copies the pixels, data can go
+            self.pixmaps[key] = QPixmap.fromImage(image)
+        return self.pixmaps[key]
+
+    def panel_size(self, font):
+        metrics = QFontMetrics(font)
+        return metrics.horizontalAdvance("frozen 99/99  PgUp/PgDn") + 20, metrics.height() + 10
+
+    def paint_panel(self, painter, font, rect):
+        metrics = QFontMetrics(font)
+        painter.setFont(font)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor(0, 0, 0, 200))
+        painter.drawRect(rect)
+        painter.setPen(QColor(0, 200, 255))
+        text = f"frozen {self.index + 1}/{len(self.snapshots)}  PgUp/PgDn"
+        painter.drawText(QPoint(rect.x() + 10, rect.y() + 5 + metrics.ascent()), text)
@@ -0,0 +1,67 @@
+# Time to first frame of main.py, headless
+# python startup.py > startup.json
+# python startup.py --runs 20 --output startup.json
+#
+# Every run is a new process (imports included) that exits as soon as its first
+# window is painted. Both paths are measured: the options menu, and going
+# straight to the ruler with a calibration saved for the monitor.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtWidgets import QApplication
+
+from benchmark import percentiles, write_results
+from calibration import CalibrationCache
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+def launch(env):
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, MAIN], env=env, capture_output=True, text=True, timeout=60).stdout
+    wall = (time.perf_counter() - start) * 1000
+    for line in output.splitlines():
+        if line.startswith("{"):
+            return json.loads(line)["first_frame_ms"], wall
+    raise RuntimeError("main.py didn't report its first frame:\n" + output)
+
+def bench_path(name, env, runs):
+    first_frames, walls = [], []
+    for _ in range(runs):
+        first_frame, wall = launch(env)
+        first_frames.append(first_frame)
+        walls.append(wall)
+    return {"benchmark": "startup", "path": name, "runs": runs,
+            "first_frame": percentiles(first_frames, 1), "process_wall": percentiles(walls, 1)}
+
+def run(runs):
+    app = QApplication.instance() or QApplication(sys.argv)
+    with tempfile.TemporaryDirectory() as folder:
+        env = dict(os.environ, SCREENRULER_STARTUP_TIMING="1",
+                   SCREENRULER_SESSION=os.path.join(folder, "session.log"))
+        results = []
+
+        env["SCREENRULER_CALIBRATION"] = os.path.join(folder, "none.json")
+        results.append(bench_path("settings", env, runs))
+
+        calibrated = CalibrationCache(os.path.join(folder, "calibrated.json"))
+        calibrated.save(app.primaryScreen(), {"h_res": "auto", "v_res": "auto", "size": "auto",
+                                              "magnifier_size": "21", "zoom": "7", "snap_radius": "8", "skip": True})
+        env["SCREENRULER_CALIBRATION"] = calibrated.path
+        results.append(bench_path("skip_settings", env, runs))
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Screen Ruler startup time")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    write_results({"python": sys.version.split()[0], "results": results}, args.output)
@@ -0,0 +1,62 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from capture import FakeCapture
+from colorstats import ColorInspector, ColorStats
+
+@pytest.fixture
+def desktop():
+    # Not a multiple of the tile size, so there are partial blocks at the right and the bottom
+    return np.random.default_rng(0).integers(0, 256, size=(203, 317, 3), dtype=np.uint8)
+
+def expected(pixels):
+    pixels = pixels.reshape(-1, 3).astype(np.float64)
+    return pixels.mean(axis=0), pixels.std(axis=0), pixels.min(axis=0), pixels.max(axis=0)
+
+@pytest.mark.parametrize("rect", [
+    (0, 0, 317, 203), # Everything
+    (5, 7, 6, 8), # One pixel
+    (3, 3, 14, 14), # Smaller than a block
+    (16, 32, 64, 96), # Exactly on the blocks
+    (17, 9, 250, 190), # Partial blocks on every side
+    (300, 190, 317, 203), # The partial blocks at the border of the frame
+])
+def test_rect_matches_brute_force(desktop, rect):
+    stats = ColorStats(desktop, (0, 0, 317, 203))
+    left, top, right, bottom = rect
+    result = stats.rect(left, top, right, bottom)
+    mean, std, low, high = expected(desktop[top:bottom, left:right])
+    assert result["size"] == (right - left, bottom - top)
+    assert result["mean"] == pytest.approx(mean.tolist())
+    assert result["std"] == pytest.approx(std.tolist(), abs=1e-6)
+    assert result["min"] == low.tolist()
+    assert result["max"] == high.tolist()
+
+def test_rect_is_global_and_clipped(desktop):
+    # The frame starts at (1000, 500) of the virtual desktop
+    stats = ColorStats(desktop, (1000, 500, 1317, 703))
+    result = stats.rect(990, 490, 1050, 530)
+    assert result["size"] == (50, 30)
+    assert result["mean"] == pytest.approx(expected(desktop[0:30, 0:50])[0].tolist())
+    assert stats.rect(0, 0, 1000, 500) is None
+
+def test_inspector_selection(desktop):
+    capture = FakeCapture(desktop)
+    capture.update((0, 0, 317, 203))
+    inspector = ColorInspector()
+    inspector.start_selection(capture, 40, 30)
+    inspector.update_selection(20, 60) # Dragged left and down from the start, both corners included
+    assert inspector.selection_bounds() == (20, 30, 41, 61)
+    assert inspector.result["mean"] == pytest.approx(expected(desktop[30:61, 20:41])[0].tolist())
+    assert inspector.pixel(capture, 5, 6) == tuple(desktop[6, 5].tolist())
+
+def test_inspector_builds_the_tables_once_per_frame(desktop):
+    capture = FakeCapture(desktop)
+    capture.update((0, 0, 317, 203))
+    inspector = ColorInspector()
+    stats = inspector.frame_stats(capture)
+    assert inspector.frame_stats(capture) is stats
+    capture.invalidate()
+    capture.update((0, 0, 317, 203))
+    assert inspector.frame_stats(capture) is not stats
@@ -0,0 +1,44 @@
+import random
+
+import pytest
+
+from dimensions import INCH_TO_CM, labels, labels_many, measure, measure_many
+
+def test_sides_include_both_ends():
+    # A single pixel is 1px wide and tall, and has no hypotenuse
+    single = measure(5, 5, 5, 5, 96, 96)
+    assert (single["x_px"], single["y_px"], single["hip_px"]) == (1, 1, 0)
+
+    dimensions = measure(0, 0, 3, 4, 96, 96)
+    assert (dimensions["x_px"], dimensions["y_px"]) == (4, 5)
+    # The hypotenuse is the distance between the points, without the + 1
+    assert dimensions["hip_px"] == 5
+
+def test_direction_doesnt_matter():
+    assert measure(10, 20, 3, 4, 96, 72) == measure(3, 4, 10, 20, 96, 72)
+
+def test_units():
+    dimensions = measure(0, 0, 95, 143, 96, 72)
+    assert dimensions["x_inches"] == pytest.approx(1)
+    assert dimensions["y_inches"] == pytest.approx(2)
+    assert dimensions["x_cm"] == pytest.approx(INCH_TO_CM)
+    assert dimensions["hip_inches"] == pytest.approx(dimensions["hip_px"] / 84)
+    assert dimensions["hip_cm"] == pytest.approx(dimensions["hip_inches"] * INCH_TO_CM)
+
+def test_measure_many_matches_measure():
+    pytest.importorskip("numpy")
+    rng = random.Random(0)
+    pairs = [[rng.randrange(-100000, 100000) for _ in range(4)] for _ in range(500)]
+    many = measure_many(*zip(*pairs), 96, 110)
+    for index, pair in enumerate(pairs):
+        one = measure(*pair, 96, 110)
+        for key, value in one.items():
+            assert many[key][index] == pytest.approx(value)
+
+def test_labels_many_matches_labels():
+    pytest.importorskip("numpy")
+    pairs = [(0, 0, 0, 0), (0, 0, 3, 4), (1919, 1079, 0, 0), (12, 7, 250, 3)]
+    texts = labels_many(measure_many(*zip(*pairs), 96, 96))
+    assert texts == [labels(measure(*pair, 96, 96)) for pair in pairs]
+    assert texts[1] == ("4px |    0.11cm |    0.04inch", "5px |    0.13cm |    0.05inch",
+                        "   5.00px |    0.13cm |    0.05inch")
@@ -0,0 +1,100 @@
+import random
+
+import pytest
+
+import measurements
+from measurements import MeasurementStore
+
+def random_measurements(count, seed=0):
+    # x0, y0, x1, y1 and bounds (left, top, right, bottom) like the ruler's, bigger than the points
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(count):
+        x0, y0 = rng.randrange(-300, 2200), rng.randrange(-300, 1300)
+        x1, y1 = x0 + rng.randint(-400, 400), y0 + rng.randint(-400, 400)
+        bounds = (min(x0, x1) - 11, min(y0, y1) - 11, max(x0, x1) + 260, max(y0, y1) + 30)
+        rows.append((x0, y0, x1, y1, bounds))
+    return rows
+
+def brute_force(store, left, top, right, bottom):
+    return [id for id in range(len(store.alive)) if store.alive[id]
+            and store.left[id] < right and left < store.right[id]
+            and store.top[id] < bottom and top < store.bottom[id]]
+
+def test_add_and_query():
+    store = MeasurementStore()
+    first = store.add(10, 10, 50, 50)
+    second = store.add(1000, 1000, 1100, 1050)
+    assert (first, second) == (0, 1)
+    assert len(store) == 2
+    assert store.bounds(first) == (10, 10, 51, 51)
+    assert store.query_rect(0, 0, 100, 100) == [first]
+    assert store.query_rect(0, 0, 2000, 2000) == [first, second]
+    assert store.query_rect(51, 51, 1000, 1000) == []
+
+def test_remove_and_restore_keep_ids():
+    store = MeasurementStore()
+    ids = [store.add(x, 10, x + 40, 60) for x in range(0, 1000, 100)]
+    store.remove(ids[3])
+    assert len(store) == 9
+    assert ids[3] not in store.query_rect(0, 0, 2000, 2000)
+    assert store.add(5, 5, 6, 6) == 10 # Ids are never reused
+    store.restore(ids[3])
+    assert ids[3] in store.query_rect(300, 0, 341, 61)
+    assert store.remove_all() == list(range(11))
+    assert len(store) == 0
+    assert store.cells == {}
+
+def test_query_matches_brute_force():
+    store = MeasurementStore()
+    for x0, y0, x1, y1, bounds in random_measurements(300):
+        store.add(x0, y0, x1, y1, bounds)
+    for id in range(0, 300, 7):
+        store.remove(id)
+    rng = random.Random(1)
+    for _ in range(100):
+        left, top = rng.randrange(-500, 2000), rng.randrange(-500, 1200)
+        right, bottom = left + rng.randint(1, 800), top + rng.randint(1, 800)
+        assert store.query_rect(left, top, right, bottom) == brute_force(store, left, top, right, bottom)
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_extend_matches_add(monkeypatch, use_numpy):
+    if not use_numpy:
+        monkeypatch.setattr(measurements, "np", None)
+    elif measurements.np is None:
+        pytest.skip("numpy isn't installed")
+    rows = random_measurements(500, seed=2)
+    alive = [index % 5 != 0 for index in range(len(rows))]
+
+    added = MeasurementStore()
+    for (x0, y0, x1, y1, bounds), keep in zip(rows, alive):
+        id = added.add(x0, y0, x1, y1, bounds)
+        if not keep:
+            added.remove(id)
+
+    extended = MeasurementStore()
+    columns = list(zip(*[(x0, y0, x1, y1) + bounds for x0, y0, x1, y1, bounds in rows]))
+    extended.extend(*columns, alive)
+    assert len(extended) == len(added)
+    assert extended.alive == added.alive
+    # Same cells, each with its ids in the order they were added
+    assert extended.cells == added.cells
+    assert [m.id for m in extended] == [m.id for m in added]
+
+def test_extend_after_add_continues_ids():
+    store = MeasurementStore()
+    store.add(0, 0, 10, 10)
+    store.extend([20], [20], [30], [30], [20], [20], [31], [31], [True])
+    assert store.query_rect(0, 0, 100, 100) == [0, 1]
+
+def test_hit_test_and_nearest():
+    store = MeasurementStore()
+    first = store.add(100, 100, 200, 200)
+    second = store.add(100, 100, 200, 200)
+    # The triangle's horizontal side, both measurements are there and the newest one wins
+    assert store.hit_test(150, 102) == second
+    assert store.hit_test(180, 130) is None # Inside the triangle, away from its sides
+    store.remove(second)
+    assert store.hit_test(150, 102) == first
+    assert store.nearest(150, 90) == first
+    assert store.nearest(150, 90, max_distance=5) is None
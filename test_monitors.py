@@ -0,0 +1,53 @@
+import math
+
+import pytest
+
+from monitors import Monitor, MonitorIndex, clipped_length
+
+@pytest.fixture
+def monitor():
+    return Monitor(0, 0, 1920, 1080, 96, 96)
+
+def test_clipped_length_inside_and_outside(monitor):
+    assert clipped_length(10, 10, 310, 410, monitor) == pytest.approx(500)
+    assert clipped_length(2000, 10, 2100, 500, monitor) == 0
+    # Zero length, inside or not
+    assert clipped_length(5, 5, 5, 5, monitor) == 0
+    assert clipped_length(-5, -5, -5, -5, monitor) == 0
+
+def test_clipped_length_crossing(monitor):
+    # Half of the segment is past the right edge (right is exclusive, the edge is at x = 1920)
+    assert clipped_length(1820, 500, 2020, 500, monitor) == pytest.approx(100)
+    # Both ends outside, through the whole monitor
+    assert clipped_length(-100, 540, 2020, 540, monitor) == pytest.approx(1920)
+    assert clipped_length(-100, -100, 1180, 1180, monitor) == pytest.approx(1080 * math.sqrt(2))
+    # Both ends outside and missing the monitor
+    assert clipped_length(-100, 1000, 100, 1200, monitor) == pytest.approx(0, abs=1e-9)
+    assert clipped_length(1800, -300, 2300, 200, monitor) == 0
+
+def test_clipped_length_along_an_edge(monitor):
+    assert clipped_length(0, 100, 0, 300, monitor) == pytest.approx(200)
+    assert clipped_length(1920, 100, 1920, 300, monitor) == pytest.approx(200) # The right edge itself
+    assert clipped_length(1921, 100, 1921, 300, monitor) == 0
+
+def test_screen_at():
+    left = Monitor(0, 0, 1920, 1080, 96, 96, "left")
+    right = Monitor(1920, 0, 2560, 1440, 110, 110, "right")
+    index = MonitorIndex([left, right])
+    assert index.screen_at(100, 100) is left
+    assert index.screen_at(1920, 100) is right
+    assert index.screen_at(1919, 1079) is left
+    # The gap under the smaller monitor goes to the closest one
+    assert index.screen_at(1000, 1300) is left
+    assert index.screen_at(1950, 1300) is right
+    assert index.desktop_bounds() == (0, 0, 4480, 1440)
+
+def test_ppi_along():
+    left = Monitor(0, 0, 1920, 1080, 100, 100)
+    right = Monitor(1920, 0, 1920, 1080, 200, 200)
+    index = MonitorIndex([left, right])
+    assert index.ppi_along(10, 10, 500, 500) == (100, 100)
+    # Half in each monitor: 1 inch in the left one and 0.5 in the right one for 200 pixels
+    ppix, ppiy = index.ppi_along(1820, 500, 2020, 500)
+    assert ppix == pytest.approx(200 / 1.5)
+    assert ppiy == pytest.approx(200 / 1.5)
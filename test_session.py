@@ -0,0 +1,114 @@
+import os
+
+import pytest
+
+import session
+from session import ADD, DO, RECORD, REMOVE, RESTORE, UNDO, SessionLog
+
+@pytest.fixture(params=["numpy", "python"])
+def load_with(request, monkeypatch):
+    # load() has a numpy path and a plain python one, both have to give the same result
+    if request.param == "python":
+        monkeypatch.setattr(session, "np", None)
+    elif session.np is None:
+        pytest.skip("numpy isn't installed")
+    return request.param
+
+def loaded(path):
+    log = SessionLog(path)
+    ids, x0, y0, x1, y1, alive = log.load()
+    columns = [[int(value) for value in column] for column in (ids, x0, y0, x1, y1)]
+    return log, columns, [bool(value) for value in alive]
+
+def test_record_format(tmp_path):
+    # 28 bytes per record: op, kind, 2 padding bytes, action, id, x0, y0, x1, y1 (little endian)
+    path = tmp_path / "session.log"
+    log = SessionLog(str(path))
+    log.add(0, 1, 2, 3, 4)
+    log.remove([0])
+    log.close()
+    data = path.read_bytes()
+    assert RECORD.size == 28
+    assert len(data) == 2 * RECORD.size
+    assert RECORD.unpack(data[:RECORD.size]) == (ADD, DO, 0, 0, 1, 2, 3, 4)
+    assert RECORD.unpack(data[RECORD.size:]) == (REMOVE, DO, 1, 0, 0, 0, 0, 0)
+
+def test_load(tmp_path, load_with):
+    path = str(tmp_path / "session.log")
+    log = SessionLog(path)
+    log.add(0, 10, 20, 30, 40)
+    log.add(1, 50, 60, 70, 80)
+    log.add(2, 1, 2, 3, 4)
+    log.remove([1])
+    log.close()
+    _, columns, alive = loaded(path)
+    assert columns == [[0, 1, 2], [10, 50, 1], [20, 60, 2], [30, 70, 3], [40, 80, 4]]
+    assert alive == [True, False, True]
+
+def test_history_is_rebuilt(tmp_path, load_with):
+    path = str(tmp_path / "session.log")
+    log = SessionLog(path)
+    log.add(0, 0, 0, 5, 5)
+    log.add(1, 0, 0, 6, 6)
+    log.remove([0, 1]) # Clearing everything is one action
+    assert log.undo() == [(RESTORE, 1), (RESTORE, 0)]
+    assert log.undo() == [(REMOVE, 1)]
+    assert log.redo() == [(RESTORE, 1)]
+    log.close()
+
+    reloaded, _, alive = loaded(path)
+    assert alive == [True, True]
+    assert reloaded.undo_stack == log.undo_stack
+    assert reloaded.redo_stack == log.redo_stack
+    assert reloaded.action == log.action
+    # Undoing after the reload goes on where the session was left
+    assert reloaded.undo() == [(REMOVE, 1)]
+    reloaded.close()
+    assert loaded(path)[2] == [True, False]
+
+def test_new_action_clears_redo(tmp_path, load_with):
+    path = str(tmp_path / "session.log")
+    log = SessionLog(path)
+    log.add(0, 0, 0, 5, 5)
+    log.undo()
+    log.add(1, 0, 0, 6, 6)
+    log.close()
+    reloaded, _, alive = loaded(path)
+    assert alive == [False, True]
+    assert reloaded.redo_stack == []
+    assert reloaded.undo_stack == [[(ADD, 1)]]
+
+def test_incomplete_record_is_dropped(tmp_path, load_with):
+    path = tmp_path / "session.log"
+    log = SessionLog(str(path))
+    log.add(0, 1, 2, 3, 4)
+    log.close()
+    with open(path, "ab") as f:
+        f.write(RECORD.pack(ADD, DO, 1, 1, 5, 6, 7, 8)[:10])
+    _, columns, alive = loaded(str(path))
+    assert columns[0] == [0]
+    assert alive == [True]
+    assert os.path.getsize(path) == RECORD.size
+
+def test_ids_without_add_are_removed(tmp_path, load_with):
+    # Records lost in the middle: the ids stay where they were, so undo still points at the right one
+    path = tmp_path / "session.log"
+    path.write_bytes(RECORD.pack(ADD, DO, 0, 0, 1, 1, 2, 2) + RECORD.pack(ADD, DO, 1, 3, 4, 4, 5, 5)
+                     + RECORD.pack(REMOVE, UNDO, 2, 3, 0, 0, 0, 0))
+    _, columns, alive = loaded(str(path))
+    assert columns[0] == [0, 1, 2, 3]
+    assert columns[1] == [1, 0, 0, 4]
+    assert alive == [True, False, False, False]
+
+def test_empty_or_missing(tmp_path):
+    assert SessionLog(str(tmp_path / "missing.log")).load() is None
+    (tmp_path / "empty.log").write_bytes(b"")
+    assert SessionLog(str(tmp_path / "empty.log")).load() is None
+
+def test_unwritable_log_keeps_working(tmp_path, capsys):
+    log = SessionLog(str(tmp_path / "missing folder" / "session.log"))
+    log.add(0, 1, 2, 3, 4)
+    assert not log.saving
+    assert "session not saved" in capsys.readouterr().err
+    log.add(1, 1, 2, 3, 4)
+    assert log.undo() == [(REMOVE, 1)]